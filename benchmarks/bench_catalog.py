@@ -0,0 +1,105 @@
+# bench_catalog.py - Coste de seleccionar y renderizar un ejercicio
+#
+# Compara la ruta original (recorrer EJERCICIOS[nivel], formatear ids y
+# sanitizar pregunta y opciones en cada llamada) con el catálogo compilado
+# (búsqueda por índice y texto ya escapado).
+#
+# Uso: python benchmarks/bench_catalog.py [--categories 20] [--per-category 50] [--rounds 20000]
+import time
+import random
+import argparse
+
+from common import import_bot
+
+
+def build_content(categories, per_category):
+    return {
+        nivel: {
+            f"categoria{c}": [
+                {
+                    "pregunta": f"¿Cuál es la forma correcta (caso {i}) de 'to be' en *{nivel}*?",
+                    "opciones": ["ser", "estar", "haber", "tener (formal)"],
+                    "respuesta": i % 4,
+                }
+                for i in range(per_category)
+            ]
+            for c in range(categories)
+        }
+        for nivel in ("principiante", "intermedio", "avanzado")
+    }
+
+
+def render_original(bot, ejercicios, nivel, completed, ordinals, streak):
+    all_exercises = []
+    for categoria, lista in ejercicios[nivel].items():
+        for idx, ejercicio in enumerate(lista):
+            exercise_id = f"{categoria}_{idx}"
+            all_exercises.append((categoria, idx, ejercicio, exercise_id, ordinals[nivel][exercise_id]))
+    available = [ex for ex in all_exercises if not bot.bitmap_has(completed, ex[4])]
+    categoria, idx, ejercicio, exercise_id, ordinal = random.choice(available)
+
+    mensaje = (
+        f"📚 *Ejercicio de {bot.sanitize_text(categoria)} ({bot.sanitize_text(nivel)})*\n"
+        f"🔥 Racha actual: {streak} días\n\n"
+        f"{bot.sanitize_text(ejercicio['pregunta'])}\n\n"
+    )
+    for opt_idx, opcion in enumerate(ejercicio["opciones"]):
+        mensaje += f"{opt_idx + 1}. {bot.sanitize_text(opcion)}\n"
+    return mensaje
+
+
+def render_catalog(bot, catalog, nivel, completed, streak):
+    available = [ex for ex in catalog.levels[nivel] if not bot.bitmap_has(completed, ex.ordinal)]
+    ejercicio = random.choice(available)
+    return f"{ejercicio.header}🔥 Racha actual: {streak} días\n\n{ejercicio.body}"
+
+
+def measure(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--per-category", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    ejercicios = build_content(args.categories, args.per_category)
+    bot = import_bot(ejercicios)
+
+    ordinals = {
+        nivel: {
+            f"{categoria}_{idx}": n
+            for n, (categoria, idx) in enumerate(
+                (categoria, idx) for categoria, lista in categorias.items() for idx in range(len(lista))
+            )
+        }
+        for nivel, categorias in ejercicios.items()
+    }
+    catalog = bot.compile_catalog(ejercicios, ordinals)
+
+    # Usuario a mitad de nivel: la mitad de los ejercicios completados
+    total = args.categories * args.per_category
+    completed = bot.bitmap_from_ordinals(range(0, total, 2))
+
+    # Misma selección en ambos casos para comparar el mismo texto
+    random.seed(1)
+    a = render_original(bot, ejercicios, "intermedio", completed, ordinals, 7)
+    random.seed(1)
+    b = render_catalog(bot, catalog, "intermedio", completed, 7)
+    assert a == b, "el catálogo compilado debe producir el mismo mensaje"
+
+    original = measure(lambda: render_original(bot, ejercicios, "intermedio", completed, ordinals, 7), args.rounds)
+    compiled = measure(lambda: render_catalog(bot, catalog, "intermedio", completed, 7), args.rounds)
+
+    print(f"Ejercicios por nivel: {total}")
+    print(f"Original:  {original:8.1f} µs/ejercicio")
+    print(f"Catálogo:  {compiled:8.1f} µs/ejercicio ({original / compiled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
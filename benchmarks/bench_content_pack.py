@@ -0,0 +1,101 @@
+# bench_content_pack.py - Carga de un banco de ejercicios grande: JSON vs content pack
+#
+# Genera un banco sintético, lo escribe como ejercicios.json y como content pack,
+# y mide tiempo de carga y memoria Python retenida de cada camino: json.load +
+# compile_catalog frente a open_content_pack (mmap).
+#
+# Uso: python benchmarks/bench_content_pack.py [--exercises 1000000] [--categories 100]
+import os
+import gc
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+from common import import_bot
+
+
+def build_content(total, categories):
+    per_category = total // (3 * categories)
+    return {
+        nivel: {
+            f"categoria{c}": [
+                {
+                    "pregunta": f"¿Cuál es la traducción {c}-{i} de 'to be' en {nivel}?",
+                    "opciones": [f"ser {i}", f"estar {i}", "haber", "tener"],
+                    "respuesta": i % 4,
+                }
+                for i in range(per_category)
+            ]
+            for c in range(categories)
+        }
+        for nivel in ("principiante", "intermedio", "avanzado")
+    }
+
+
+def sequential_ordinals(ejercicios):
+    return {
+        nivel: {
+            key: n
+            for n, key in enumerate(
+                f"{categoria}_{idx}" for categoria, lista in categorias.items() for idx in range(len(lista))
+            )
+        }
+        for nivel, categorias in ejercicios.items()
+    }
+
+
+def measure(fn):
+    # Tiempo y memoria en pasadas separadas: tracemalloc distorsiona los tiempos
+    gc.collect()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, retained
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exercises", type=int, default=1000000)
+    parser.add_argument("--categories", type=int, default=100)
+    args = parser.parse_args()
+
+    ejercicios = build_content(args.exercises, args.categories)
+    bot = import_bot()
+    ordinals = sequential_ordinals(ejercicios)
+
+    with open("ejercicios_grande.json", "w", encoding="utf-8") as f:
+        json.dump(ejercicios, f, ensure_ascii=False)
+    size = bot.write_content_pack("content.pack", ejercicios, ordinals)
+    total = sum(len(lista) for categorias in ejercicios.values() for lista in categorias.values())
+    del ejercicios
+    print(f"Ejercicios: {total}  JSON: {os.path.getsize('ejercicios_grande.json') / 1e6:.1f} MB  "
+          f"pack: {size / 1e6:.1f} MB")
+
+    def load_json():
+        with open("ejercicios_grande.json", "r", encoding="utf-8") as f:
+            return bot.compile_catalog(json.load(f), ordinals)
+
+    # El pack primero: con el catálogo JSON vivo, cualquier pasada del GC recorre millones de objetos
+    pack_catalog, pack_time, pack_mem = measure(lambda: bot.open_content_pack("content.pack"))
+    json_catalog, json_time, json_mem = measure(load_json)
+
+    # Ambos caminos deben devolver los mismos ejercicios
+    for _ in range(1000):
+        nivel = random.choice(list(json_catalog.levels))
+        ordinal = random.randrange(len(json_catalog.by_ordinal[nivel]))
+        assert json_catalog.get(nivel, ordinal) == pack_catalog.get(nivel, ordinal)
+
+    print(f"JSON + compilar: {json_time * 1000:9.1f} ms  {json_mem / 1e6:8.1f} MB en el heap")
+    print(f"Content pack:    {pack_time * 1000:9.1f} ms  {pack_mem / 1e6:8.1f} MB en el heap")
+
+
+if __name__ == "__main__":
+    main()
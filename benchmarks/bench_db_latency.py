@@ -0,0 +1,115 @@
+# bench_db_latency.py - Actualizaciones/segundo con latencia artificial de base de datos
+#
+# Compara el acceso síncrono original (db_cursor() llamado dentro del handler,
+# bloqueando el event loop) con el acceso asíncrono vía run_db().
+#
+# Uso: python benchmarks/bench_db_latency.py [--updates 200] [--latency 0.05]
+import time
+import asyncio
+import argparse
+
+from common import import_bot
+
+bot = import_bot()
+
+
+class FakeCursor:
+    def __init__(self, latency):
+        self.latency = latency
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        time.sleep(self.latency)
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def cursor(self):
+        return FakeCursor(self.latency)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """Pool sin PostgreSQL: cada sentencia tarda `latency` segundos"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def getconn(self):
+        return FakeConnection(self.latency)
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
+
+
+async def update_blocking(user_id):
+    # Flujo de /ejercicio antes del cambio: tres viajes síncronos en el event loop
+    with bot.db_cursor() as cursor:
+        cursor.execute("SELECT 1 FROM blocked_users WHERE user_id = %s", (user_id,))
+    with bot.db_cursor() as cursor:
+        cursor.execute("SELECT last_practice, streak_days FROM users WHERE user_id = %s", (user_id,))
+    with bot.db_cursor() as cursor:
+        cursor.execute("SELECT level, completed_exercises FROM users WHERE user_id = %s", (user_id,))
+
+
+async def update_async(user_id):
+    # Los mismos tres viajes, esperados con run_db
+    await bot.db_fetchone("SELECT 1 FROM blocked_users WHERE user_id = %s", (user_id,))
+    await bot.db_fetchone("SELECT last_practice, streak_days FROM users WHERE user_id = %s", (user_id,))
+    await bot.db_fetchone("SELECT level, completed_exercises FROM users WHERE user_id = %s", (user_id,))
+
+
+async def run(handler, updates):
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(user_id) for user_id in range(updates)))
+    return updates / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    bot.connection_pool = FakePool(args.latency)
+    bot.db_executor = bot.ThreadPoolExecutor(
+        max_workers=bot.Config.DB_POOL_MAX,
+        thread_name_prefix="db"
+    )
+
+    try:
+        before = asyncio.run(run(update_blocking, args.updates))
+        after = asyncio.run(run(update_async, args.updates))
+    finally:
+        bot.close_db_pool()
+
+    print(f"Latencia artificial: {args.latency * 1000:.0f} ms, {args.updates} actualizaciones")
+    print(f"Síncrono (antes):  {before:8.1f} actualizaciones/s")
+    print(f"run_db (después):  {after:8.1f} actualizaciones/s")
+    print(f"Mejora:            {after / before:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
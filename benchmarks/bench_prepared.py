@@ -0,0 +1,82 @@
+# bench_prepared.py - Latencia de la ruta por respuesta: SQL planificado vs sentencia preparada
+#
+# Necesita una base de datos PostgreSQL real (variables DB_* del .env). Usa un usuario
+# de prueba con user_id negativo y lo elimina al terminar. El esquema debe estar ya en
+# la última versión ('python spanishDailybot.py migrate'); el benchmark no lo migra.
+#
+# Uso: python benchmarks/bench_prepared.py [--iterations 2000]
+import time
+import argparse
+import statistics
+
+from common import import_bot
+
+bot = import_bot()
+
+BENCH_USER_ID = -424242
+
+
+def answer_path(cursor, iteration):
+    # Lo que hace una respuesta correcta: perfil al inicio del update + marcar el ejercicio
+    bot.execute_query(cursor, bot.LOAD_PROFILE, {"user_id": BENCH_USER_ID, "username": "bench"})
+    cursor.fetchone()
+    params = {"user_id": BENCH_USER_ID, "achievement_id": None}
+    params.update(bot.completed_bit_params(iteration % 500))
+    bot.execute_query(cursor, bot.RECORD_ANSWER_MARKED, params)
+    cursor.fetchone()
+
+
+def measure(iterations):
+    samples = []
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        with bot.db_cursor() as cursor:
+            answer_path(cursor, iteration)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<12} media {statistics.mean(samples):6.3f} ms  "
+          f"p50 {statistics.median(samples):6.3f} ms  p95 {p95:6.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    # Un solo hilo y una sola conexión: se mide la latencia, no la concurrencia
+    bot.Config.DB_POOL_MIN = bot.Config.DB_POOL_MAX = 1
+    bot.init_db_pool()
+    # Nunca migrar desde aquí: el bot se importó con contenido de prueba y la
+    # migración 2 calcula el bitmap a partir de ese contenido
+    bot.Config.DB_AUTO_MIGRATE = False
+    try:
+        bot.ensure_schema()
+    except SystemExit:
+        bot.close_db_pool()
+        raise
+
+    try:
+        bot.prepared_statements_enabled = False
+        measure(100)  # calentamiento
+        planned = measure(args.iterations)
+
+        bot.prepared_statements_enabled = True
+        measure(100)
+        prepared = measure(args.iterations)
+
+        print(f"Ruta por respuesta, {args.iterations} iteraciones")
+        report("Planificado", planned)
+        report("Preparado", prepared)
+    finally:
+        with bot.db_cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE user_id = %s", (BENCH_USER_ID,))
+        bot.close_db_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# bench_transport.py - Latencia de extremo a extremo de los updates: polling vs webhook
+#
+# Levanta una API de Telegram falsa en localhost y mide el tiempo desde que
+# "Telegram" tiene un update hasta que el handler lo recibe:
+#   - polling: el update queda en la cola de getUpdates (long polling)
+#   - webhook: el emisor falso hace POST al servidor del bot con el secret token
+# --rtt simula el viaje de ida y vuelta entre Telegram y el bot.
+# El modo webhook necesita tornado (python-telegram-bot[webhooks]).
+#
+# Uso: python benchmarks/bench_transport.py [--mode both] [--updates 500] [--rate 100] [--rtt 0.05]
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from urllib.parse import parse_qs
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from common import import_bot
+
+TOKEN = "123456:BENCH"
+SECRET = "bench-secret"
+
+
+class FakeTelegram:
+    """API de Telegram mínima: getMe, getUpdates (long polling), setWebhook..."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.pending = []
+        self.arrived = asyncio.Event()
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def push(self, update):
+        self.pending.append(update)
+        self.arrived.set()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method_path = lines[0].split(" ")[1]
+                headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+                length = int(headers.get("Content-Length", headers.get("content-length", 0)))
+                body = await reader.readexactly(length) if length else b""
+                result = await self.call(method_path.rsplit("/", 1)[-1], self.parse(headers, body))
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def parse(headers, body):
+        content_type = headers.get("Content-Type", headers.get("content-type", ""))
+        if "json" in content_type:
+            return json.loads(body or b"{}")
+        params = {}
+        for key, values in parse_qs(body.decode()).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+        return params
+
+    async def call(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method != "getUpdates":
+            # deleteWebhook, setWebhook, sendMessage...
+            return True
+
+        # La petición tarda rtt/2 en llegar a Telegram y la respuesta otro rtt/2
+        await asyncio.sleep(self.rtt / 2)
+        offset = int(params.get("offset") or 0)
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        if not self.pending:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        batch, self.pending = self.pending[:100], self.pending[100:]
+        await asyncio.sleep(self.rtt / 2)
+        return batch
+
+
+def make_update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+            "text": "hola",
+        },
+    }
+
+
+async def run(mode, args):
+    fake = FakeTelegram(args.rtt)
+    api_port = await fake.start()
+    sent, latencies = {}, []
+    done = asyncio.Event()
+
+    async def record(update: Update, context):
+        latencies.append(time.perf_counter() - sent[update.update_id])
+        if len(latencies) == args.updates:
+            done.set()
+
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(f"http://127.0.0.1:{api_port}/bot")
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, record))
+    await application.initialize()
+
+    if mode == "polling":
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    else:
+        await application.updater.start_webhook(
+            listen="127.0.0.1",
+            port=args.webhook_port,
+            url_path="telegram",
+            webhook_url=f"http://127.0.0.1:{args.webhook_port}/telegram",
+            secret_token=SECRET,
+            max_connections=args.max_connections,
+        )
+    await application.start()
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.max_connections)) as client:
+        async def deliver(update):
+            # Telegram -> webhook: medio viaje de red
+            await asyncio.sleep(args.rtt / 2)
+            response = await client.post(
+                f"http://127.0.0.1:{args.webhook_port}/telegram",
+                json=update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+            )
+            response.raise_for_status()
+
+        deliveries = []
+        for update_id in range(1, args.updates + 1):
+            update = make_update(update_id)
+            sent[update_id] = time.perf_counter()
+            if mode == "polling":
+                fake.push(update)
+            else:
+                deliveries.append(asyncio.create_task(deliver(update)))
+            await asyncio.sleep(1 / args.rate)
+        await asyncio.wait_for(done.wait(), timeout=60)
+        await asyncio.gather(*deliveries)
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await fake.stop()
+
+    latencies.sort()
+    ms = [value * 1000 for value in latencies]
+    print(
+        f"{mode:8s} media {statistics.mean(ms):7.1f} ms  p50 {ms[len(ms) // 2]:7.1f} ms  "
+        f"p95 {ms[int(len(ms) * 0.95)]:7.1f} ms  máx {ms[-1]:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("polling", "webhook", "both"), default="both")
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=100, help="updates por segundo")
+    parser.add_argument("--rtt", type=float, default=0.05, help="ida y vuelta Telegram <-> bot (s)")
+    parser.add_argument("--webhook-port", type=int, default=8799)
+    parser.add_argument("--max-connections", type=int, default=40)
+    args = parser.parse_args()
+
+    # Mismos límites que el bot en producción
+    bot = import_bot()
+    if args.max_connections == parser.get_default("max_connections"):
+        args.max_connections = bot.Config.WEBHOOK_MAX_CONNECTIONS
+
+    modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+    print(f"{args.updates} updates a {args.rate:.0f}/s, rtt {args.rtt * 1000:.0f} ms")
+    for mode in modes:
+        asyncio.run(run(mode, args))
+
+
+if __name__ == "__main__":
+    main()
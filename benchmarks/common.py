@@ -0,0 +1,28 @@
+# common.py - Utilidades compartidas por los benchmarks
+import os
+import sys
+import json
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Contenido mínimo para poder importar el bot fuera del directorio de despliegue
+EJERCICIOS_MINIMOS = {
+    "principiante": {"vocabulario": [
+        {"pregunta": "¿Cómo se dice 'hello'?", "opciones": ["Hola", "Adiós"], "respuesta": 0}
+    ]}
+}
+CURIOSIDADES_MINIMAS = {"curiosidades": [{"categoria": "general", "texto": "La ñ es única."}]}
+
+
+def import_bot(ejercicios=None, curiosidades=None):
+    """Importa spanishDailybot desde un directorio temporal con el contenido indicado"""
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp())
+    with open("ejercicios.json", "w", encoding="utf-8") as f:
+        json.dump(ejercicios or EJERCICIOS_MINIMOS, f, ensure_ascii=False)
+    with open("curiosidades.json", "w", encoding="utf-8") as f:
+        json.dump(curiosidades or CURIOSIDADES_MINIMAS, f, ensure_ascii=False)
+
+    import spanishDailybot
+    return spanishDailybot
@@ -1,13 +1,27 @@
 # spanishDailybot.py - Versión completa con todas las funcionalidades
+import io
 import os
+import sys
 import json
 import re
+import mmap
+import hashlib
+import unicodedata
+import struct
 import random
-import uuid
+import secrets
+import asyncio
+import functools
 import logging
+import threading
+import select
+import contextvars
 import pytz
 import psycopg2
-from datetime import datetime, time
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import datetime, date, time, timedelta, timezone
+from time import monotonic
 from dotenv import load_dotenv
 from telegram import (
     Update,
@@ -16,17 +30,25 @@ from telegram import (
     InlineKeyboardButton,
     ReplyKeyboardRemove
 )
+from telegram.error import Forbidden, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
+    CallbackContext,
     CommandHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes,
     CallbackQueryHandler,
     ConversationHandler
 )
-from psycopg2.pool import SimpleConnectionPool
-from contextlib import contextmanager
+from psycopg2 import errors as pg_errors
+from psycopg2.pool import PoolError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.extras import execute_values
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuración inicial
 load_dotenv()
@@ -44,6 +66,31 @@ class Config:
     TOKEN = os.getenv("TOKEN")
     ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", 0))
 
+    # Transporte de updates: "polling" (getUpdates) o "webhook" (servidor HTTP propio)
+    BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+    # URL pública base del webhook (p. ej. https://mi-app.herokuapp.com)
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+    WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", 8443)))
+    # Telegram lo envía en X-Telegram-Bot-Api-Secret-Token; sin él no se acepta el update
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    # Conexiones HTTPS simultáneas que Telegram abre hacia el webhook (1-100)
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+
+    # Envíos masivos: mensajes por segundo (Telegram admite ~30 en total) y envíos simultáneos
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+    BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))
+    # Destinatarios por página; el progreso se guarda al terminar cada página
+    BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", 100))
+    # Segundos que un worker se reserva un envío sin guardar progreso antes de que otro lo retome
+    BROADCAST_LEASE = int(os.getenv("BROADCAST_LEASE", 120))
+
+    # Updates de usuarios distintos que se procesan a la vez (los de un mismo usuario, en orden)
+    CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 32))
+    # Updates admitidos en vuelo, incluidos los que esperan su turno detrás del mismo usuario
+    MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", 1024))
+
     # Configuración de la base de datos
     DB_CONFIG = {
         "dbname": os.getenv("DB_NAME"),
@@ -53,102 +100,1658 @@ class Config:
         "port": os.getenv("DB_PORT", "5432")
     }
 
+    # Tamaño del pool de conexiones (y de los hilos dedicados a la base de datos)
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+    # Segundos que un hilo espera una conexión libre antes de fallar
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+    # Conexiones inactivas más tiempo que esto se validan con SELECT 1 antes de usarse
+    DB_POOL_VALIDATE_AFTER = float(os.getenv("DB_POOL_VALIDATE_AFTER", 30))
+    # Cada cuántos segundos se registran las métricas del pool (0 = nunca)
+    DB_POOL_STATS_INTERVAL = int(os.getenv("DB_POOL_STATS_INTERVAL", 300))
+
+    # Réplica de lectura opcional (DSN de libpq); sin ella todo va al primario
+    DB_REPLICA_DSN = os.getenv("DB_REPLICA_DSN")
+    DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", DB_POOL_MAX))
+    # Retraso máximo (segundos) tolerado antes de volver a leer del primario
+    DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", 5))
+    DB_REPLICA_LAG_CHECK_INTERVAL = int(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", 10))
+
+    # Sentencias preparadas por conexión; desactivar detrás de un pooler en modo transacción
+    DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "true").lower() == "true"
+
+    # Aplicar migraciones pendientes al arrancar el worker (si no, usar el comando migrate)
+    DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "false").lower() == "true"
+
+    # Cada cuántos segundos se vuelcan los contadores acumulados en memoria
+    COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", 5))
+
+    # Cada cuántos segundos se comprueba si cambiaron los ficheros de contenido (0 = no vigilar)
+    CONTENT_WATCH_INTERVAL = float(os.getenv("CONTENT_WATCH_INTERVAL", 30))
+    # Content pack binario (python spanishDailybot.py build-pack); vacío = usar ejercicios.json
+    CONTENT_PACK = os.getenv("CONTENT_PACK", "")
+
+    # Registro de intentos: volcado periódico con COPY, o antes si se llena el lote
+    ATTEMPT_FLUSH_INTERVAL = float(os.getenv("ATTEMPT_FLUSH_INTERVAL", 5))
+    ATTEMPT_FLUSH_SIZE = int(os.getenv("ATTEMPT_FLUSH_SIZE", 500))
+    # Máximo de intentos retenidos en memoria si la base de datos no responde
+    ATTEMPT_BUFFER_MAX = int(os.getenv("ATTEMPT_BUFFER_MAX", 100000))
+
+# ========================================
+# POOL DE CONEXIONES
+# ========================================
+
+class PoolTimeout(PoolError):
+    """No hubo una conexión libre dentro del tiempo de espera"""
+
+class PoolMetrics:
+    """Acumula tiempos de espera y de uso de las conexiones"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.checkout_total = 0.0
+        self.checkout_max = 0.0
+        self.returns = 0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def record_checkout(self, seconds: float):
+        self.returns += 1
+        self.checkout_total += seconds
+        self.checkout_max = max(self.checkout_max, seconds)
+
+class BotConnection(psycopg2.extensions.connection):
+    """Conexión que recuerda qué sentencias tiene preparadas en su sesión"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+class BoundedConnectionPool:
+    """Pool thread-safe que espera (con timeout) cuando está lleno y recicla conexiones rotas"""
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float,
+                 validate_after: float, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self.kwargs = kwargs
+        self.metrics = PoolMetrics()
+        self._cond = threading.Condition()
+        self._idle = []  # [(conexión, momento en que volvió al pool)]
+        self._in_use = {}  # id(conexión) -> momento del checkout
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), monotonic()))
+            self._size += 1
+
+    def getconn(self):
+        start = monotonic()
+        deadline = start + self.timeout
+        conn, returned_at = None, None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("El pool de conexiones está cerrado")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Reservar el hueco; la conexión se abre fuera del lock
+                    self._size += 1
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    self.metrics.timeouts += 1
+                    raise PoolTimeout(
+                        f"Sin conexiones libres tras {self.timeout}s ({self.maxconn} en uso)"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            if conn is not None and not self._is_usable(conn, returned_at):
+                self._close_quietly(conn)
+                self.metrics.recycled += 1
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            # Liberar el hueco reservado para que otro hilo pueda intentarlo
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        now = monotonic()
+        with self._cond:
+            self._in_use[id(conn)] = now
+            self.metrics.record_wait(now - start)
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        now = monotonic()
+        if not close and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+        close = close or bool(conn.closed)
+
+        with self._cond:
+            checked_out_at = self._in_use.pop(id(conn), None)
+            if checked_out_at is not None:
+                self.metrics.record_checkout(now - checked_out_at)
+            if close or self._closed:
+                self._size -= 1
+                if close:
+                    self.metrics.recycled += 1
+            else:
+                self._idle.append((conn, now))
+            self._cond.notify()
+
+        if close or self._closed:
+            self._close_quietly(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> dict:
+        """Foto de los indicadores del pool"""
+        with self._cond:
+            m = self.metrics
+            return {
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "max": self.maxconn,
+                "checkouts": m.checkouts,
+                "timeouts": m.timeouts,
+                "recycled": m.recycled,
+                "wait_avg_ms": 1000 * m.wait_total / m.checkouts if m.checkouts else 0.0,
+                "wait_max_ms": 1000 * m.wait_max,
+                "checkout_avg_ms": 1000 * m.checkout_total / m.returns if m.returns else 0.0,
+                "checkout_max_ms": 1000 * m.checkout_max,
+            }
+
+    def _connect(self):
+        return psycopg2.connect(connection_factory=BotConnection, **self.kwargs)
+
+    def _is_usable(self, conn, returned_at: float) -> bool:
+        if conn.closed:
+            return False
+        if monotonic() - returned_at < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
 # Pool de conexiones para la base de datos
 connection_pool = None
+replica_pool = None
+db_executor = None
+replica_executor = None
 
 def init_db_pool():
-    global connection_pool
-    connection_pool = SimpleConnectionPool(
-        minconn=1,
-        maxconn=10,
+    global connection_pool, replica_pool, db_executor, replica_executor
+    connection_pool = BoundedConnectionPool(
+        minconn=Config.DB_POOL_MIN,
+        maxconn=Config.DB_POOL_MAX,
+        timeout=Config.DB_POOL_TIMEOUT,
+        validate_after=Config.DB_POOL_VALIDATE_AFTER,
         **Config.DB_CONFIG
     )
+    # Cada executor tiene tantos hilos como conexiones su pool, así ningún hilo espera al
+    # pool: aunque la réplica se descarte, el primario nunca recibe más de DB_POOL_MAX
+    db_executor = ThreadPoolExecutor(
+        max_workers=Config.DB_POOL_MAX,
+        thread_name_prefix="db"
+    )
+
+    if Config.DB_REPLICA_DSN:
+        replica_pool = BoundedConnectionPool(
+            minconn=Config.DB_POOL_MIN,
+            maxconn=Config.DB_REPLICA_POOL_MAX,
+            timeout=Config.DB_POOL_TIMEOUT,
+            validate_after=Config.DB_POOL_VALIDATE_AFTER,
+            dsn=Config.DB_REPLICA_DSN
+        )
+        replica_executor = ThreadPoolExecutor(
+            max_workers=Config.DB_REPLICA_POOL_MAX,
+            thread_name_prefix="db-replica"
+        )
+
+def close_db_pool():
+    """Libera los hilos y conexiones de la base de datos"""
+    if db_executor:
+        db_executor.shutdown(wait=True)
+    if replica_executor:
+        replica_executor.shutdown(wait=True)
+    if connection_pool:
+        connection_pool.closeall()
+    if replica_pool:
+        replica_pool.closeall()
 
 @contextmanager
-def db_cursor():
-    conn = connection_pool.getconn()
+def db_cursor(pool=None):
+    pool = pool or connection_pool
+    conn = pool.getconn()
+    broken = False
     try:
         with conn.cursor() as cursor:
             yield cursor
         conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        # Conexión caída: se descarta en lugar de volver al pool
+        broken = True
+        logger.error(f"Conexión a DB perdida: {e}")
+        raise
     except Exception as e:
         conn.rollback()
         logger.error(f"Error en DB: {e}")
         raise
     finally:
-        connection_pool.putconn(conn)
+        pool.putconn(conn, close=broken)
 
-def create_tables():
-    with db_cursor() as cursor:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username VARCHAR(50),
-                level VARCHAR(20) DEFAULT 'principiante',
-                exercises INT DEFAULT 0,
-                referrals INT DEFAULT 0,
-                challenge_score INT DEFAULT 0,
-                completed_exercises TEXT DEFAULT '',
-                streak_days INT DEFAULT 0,
-                last_practice DATE
+# ========================================
+# ACCESO ASÍNCRONO A LA BASE DE DATOS
+# ========================================
+
+def run_in_cursor(fn, *args, pool=None):
+    """Ejecuta fn(cursor, *args) dentro de una transacción"""
+    try:
+        with db_cursor(pool) as cursor:
+            return fn(cursor, *args)
+    except (pg_errors.InvalidSqlStatementName, pg_errors.DuplicatePreparedStatement):
+        # execute_query acaba de desactivar las sentencias preparadas (pooler en modo
+        # transacción): se repite la transacción entera, una vez, con SQL normal
+        if prepared_statements_enabled:
+            raise
+        with db_cursor(pool) as cursor:
+            return fn(cursor, *args)
+
+# Contexto del update en curso, para contar sus consultas a la base de datos
+current_update_context = contextvars.ContextVar("current_update_context", default=None)
+
+async def run_db(fn, *args, read_only: bool = False):
+    """Ejecuta fn(cursor, *args) en el pool de hilos sin bloquear el event loop"""
+    context = current_update_context.get()
+    if context is not None:
+        context.db_calls += 1
+    pool = select_pool(read_only)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        replica_executor if pool is replica_pool else db_executor,
+        functools.partial(run_in_cursor, fn, *args, pool=pool)
+    )
+
+# ========================================
+# RÉPLICA DE LECTURA
+# ========================================
+
+# Solo van a la réplica las consultas registradas con read_only=True; el resto
+# (también los INSERT/UPDATE ... RETURNING de db_fetchone) va al primario
+
+# Último retraso medido de la réplica en segundos (None = desconocido o caída)
+replica_lag = None
+
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+def select_pool(read_only: bool):
+    """Réplica para lecturas si existe y va al día; si no, el primario"""
+    if (
+        read_only
+        and replica_pool is not None
+        and replica_lag is not None
+        and replica_lag <= Config.DB_REPLICA_MAX_LAG
+    ):
+        return replica_pool
+    return connection_pool
+
+def check_replica_lag():
+    """Mide el retraso de la réplica; si no responde, las lecturas vuelven al primario"""
+    global replica_lag
+    if replica_pool is None:
+        return None
+    try:
+        with db_cursor(replica_pool) as cursor:
+            cursor.execute(REPLICA_LAG_QUERY)
+            lag = float(cursor.fetchone()[0])
+    except Exception as e:
+        logger.error(f"Error al medir el retraso de la réplica: {e}")
+        lag = None
+
+    was_usable = replica_lag is not None and replica_lag <= Config.DB_REPLICA_MAX_LAG
+    usable = lag is not None and lag <= Config.DB_REPLICA_MAX_LAG
+    if usable != was_usable:
+        estado = "disponible" if usable else "descartada"
+        logger.warning(f"Réplica {estado} para lecturas (retraso: {lag})")
+    replica_lag = lag
+    return lag
+
+async def monitor_replica_lag(context: ContextTypes.DEFAULT_TYPE):
+    """Job periódico: actualiza replica_lag sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(replica_executor or db_executor, check_replica_lag)
+
+# ========================================
+# REGISTRO DE SENTENCIAS PREPARADAS
+# ========================================
+
+class PreparedQuery:
+    """Consulta con parámetros %(nombre)s que se prepara una vez por conexión"""
+
+    def __init__(self, name: str, sql: str, read_only: bool = False):
+        self.name = name
+        self.sql = sql
+        self.read_only = read_only
+        self.param_names = []
+
+        def placeholder(match):
+            if match.group(1) not in self.param_names:
+                self.param_names.append(match.group(1))
+            return f"${self.param_names.index(match.group(1)) + 1}"
+
+        body = re.sub(r"%\((\w+)\)s", placeholder, sql).replace("%%", "%")
+        self.prepare_sql = f"PREPARE {name} AS {body}"
+        placeholders = ", ".join(["%s"] * len(self.param_names))
+        self.execute_sql = f"EXECUTE {name} ({placeholders})" if placeholders else f"EXECUTE {name}"
+
+# nombre -> PreparedQuery
+QUERIES = {}
+prepared_statements_enabled = Config.DB_PREPARED_STATEMENTS
+
+def register_query(name: str, sql: str, read_only: bool = False) -> PreparedQuery:
+    """Registra una consulta caliente para ejecutarla como sentencia preparada"""
+    query = PreparedQuery(name, sql, read_only)
+    QUERIES[name] = query
+    return query
+
+def execute_query(cursor, query, params):
+    """Ejecuta SQL normal o una PreparedQuery (PREPARE la primera vez en cada conexión)"""
+    global prepared_statements_enabled
+    if not isinstance(query, PreparedQuery):
+        cursor.execute(query, params)
+        return
+
+    prepared = getattr(getattr(cursor, "connection", None), "prepared_statements", None)
+    if not prepared_statements_enabled or prepared is None:
+        cursor.execute(query.sql, params)
+        return
+
+    try:
+        if query.name not in prepared:
+            cursor.execute(query.prepare_sql)
+            prepared.add(query.name)
+        cursor.execute(query.execute_sql, [params[name] for name in query.param_names])
+    except (pg_errors.InvalidSqlStatementName, pg_errors.DuplicatePreparedStatement):
+        # La sesión no es la que preparamos: hay un pooler en modo transacción delante.
+        # run_in_cursor repite la transacción con SQL normal
+        prepared_statements_enabled = False
+        logger.warning("Sentencias preparadas desactivadas: la sesión de PostgreSQL no es estable")
+        raise
+
+def fetchone_tx(cursor, query, params):
+    execute_query(cursor, query, params)
+    return cursor.fetchone()
+
+def fetchall_tx(cursor, query, params):
+    execute_query(cursor, query, params)
+    return cursor.fetchall()
+
+def execute_tx(cursor, query, params):
+    execute_query(cursor, query, params)
+    return cursor.rowcount
+
+async def db_fetchone(query, params=()):
+    return await run_db(fetchone_tx, query, params, read_only=getattr(query, "read_only", False))
+
+async def db_fetchall(query, params=()):
+    return await run_db(fetchall_tx, query, params, read_only=getattr(query, "read_only", False))
+
+async def db_execute(query, params=()) -> int:
+    return await run_db(execute_tx, query, params)
+
+# ========================================
+# CONTADORES CON ESCRITURA DIFERIDA
+# ========================================
+
+COUNTER_COLUMNS = ("exercises", "referrals", "challenge_score", "exercise_cursor", "curiosity_offset")
+
+# Un único UPDATE por lote; el orden por user_id evita interbloqueos entre workers
+FLUSH_COUNTERS = """
+    UPDATE users SET
+        exercises = users.exercises + v.exercises,
+        referrals = users.referrals + v.referrals,
+        challenge_score = users.challenge_score + v.challenge_score,
+        exercise_cursor = users.exercise_cursor + v.exercise_cursor,
+        curiosity_offset = users.curiosity_offset + v.curiosity_offset
+    FROM (VALUES %s) AS v(user_id, exercises, referrals, challenge_score, exercise_cursor,
+                          curiosity_offset)
+    WHERE users.user_id = v.user_id
+"""
+
+class CounterBuffer:
+    """Acumula incrementos de contadores por usuario y los vuelca en lote"""
+
+    def __init__(self, page_size: int = 1000):
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # user_id -> [delta por columna de COUNTER_COLUMNS]
+        self._in_flight = {}  # lote que se está escribiendo ahora mismo
+
+    def add(self, user_id: int, column: str, delta: int = 1):
+        index = COUNTER_COLUMNS.index(column)
+        with self._lock:
+            deltas = self._pending.setdefault(user_id, [0] * len(COUNTER_COLUMNS))
+            deltas[index] += delta
+
+    def pending(self, user_id: int) -> dict:
+        """Incrementos aún no visibles en la base de datos (incluye el lote en curso)"""
+        with self._lock:
+            totals = [0] * len(COUNTER_COLUMNS)
+            for source in (self._pending, self._in_flight):
+                for index, delta in enumerate(source.get(user_id, ())):
+                    totals[index] += delta
+        return dict(zip(COUNTER_COLUMNS, totals))
+
+    def flush(self) -> int:
+        """Escribe los incrementos pendientes; si falla, vuelven al buffer"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._in_flight = batch
+
+            rows = sorted((user_id, *deltas) for user_id, deltas in batch.items())
+            try:
+                with db_cursor() as cursor:
+                    execute_values(cursor, FLUSH_COUNTERS, rows, page_size=self.page_size)
+            except Exception:
+                with self._lock:
+                    for user_id, deltas in batch.items():
+                        pending = self._pending.setdefault(user_id, [0] * len(COUNTER_COLUMNS))
+                        for index, delta in enumerate(deltas):
+                            pending[index] += delta
+                    self._in_flight = {}
+                raise
+
+            with self._lock:
+                self._in_flight = {}
+            return len(rows)
+
+counter_buffer = CounterBuffer()
+
+async def flush_counters(context: ContextTypes.DEFAULT_TYPE):
+    """Vuelca periódicamente los contadores acumulados"""
+    try:
+        loop = asyncio.get_running_loop()
+        flushed = await loop.run_in_executor(db_executor, counter_buffer.flush)
+        if flushed:
+            logger.debug(f"Contadores volcados para {flushed} usuarios")
+    except Exception as e:
+        logger.error(f"Error al volcar contadores: {e}")
+
+# ========================================
+# REGISTRO DE INTENTOS (COPY EN LOTES)
+# ========================================
+
+ATTEMPT_COLUMNS = (
+    "user_id", "exercise_id", "level", "chosen_option", "is_correct", "latency_ms", "attempted_at"
+)
+
+def copy_value(value) -> str:
+    """Formatea un valor para COPY ... FROM STDIN en formato texto"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+class AttemptLog:
+    """Cola en memoria de intentos de ejercicios que se vuelca con COPY"""
+
+    def __init__(self, max_buffer: int):
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def record(self, user_id: int, exercise_id: str, level: str, chosen_option,
+               is_correct: bool, issued_at: datetime = None):
+        now = datetime.now(timezone.utc)
+        latency_ms = int((now - issued_at).total_seconds() * 1000) if issued_at else None
+        row = (user_id, exercise_id, level, chosen_option, is_correct, latency_ms, now)
+        with self._lock:
+            self._rows.append(row)
+            self._trim()
+
+    def flush(self) -> int:
+        """Escribe los intentos acumulados; si falla, vuelven a la cola"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            data = io.StringIO()
+            for row in rows:
+                data.write("\t".join(copy_value(value) for value in row))
+                data.write("\n")
+            data.seek(0)
+
+            try:
+                with db_cursor() as cursor:
+                    cursor.copy_expert(
+                        f"COPY exercise_attempts ({', '.join(ATTEMPT_COLUMNS)}) FROM STDIN",
+                        data
+                    )
+            except Exception:
+                with self._lock:
+                    self._rows = rows + self._rows
+                    self._trim()
+                raise
+            return len(rows)
+
+    def _trim(self):
+        # Con la base de datos caída se descartan los intentos más antiguos
+        overflow = len(self._rows) - self.max_buffer
+        if overflow > 0:
+            del self._rows[:overflow]
+            self.dropped += overflow
+            logger.warning(f"Registro de intentos lleno: {overflow} intentos descartados")
+
+attempt_log = AttemptLog(Config.ATTEMPT_BUFFER_MAX)
+
+async def flush_attempts(context: ContextTypes.DEFAULT_TYPE = None):
+    """Vuelca el registro de intentos (job periódico o lote lleno)"""
+    try:
+        loop = asyncio.get_running_loop()
+        flushed = await loop.run_in_executor(db_executor, attempt_log.flush)
+        if flushed:
+            logger.debug(f"Intentos registrados: {flushed}")
+    except Exception as e:
+        logger.error(f"Error al volcar intentos: {e}")
+
+# Volcado lanzado por lote lleno: como mucho uno a la vez, para no ocupar los hilos
+# de la DB con volcados en espera si el COPY va lento o la DB no responde
+attempt_flush_task = None
+
+def schedule_attempt_flush(application):
+    global attempt_flush_task
+    if attempt_flush_task is None or attempt_flush_task.done():
+        attempt_flush_task = application.create_task(flush_attempts())
+
+def attempt_partition_bounds(day: date):
+    start = day.replace(day=1)
+    end = (start.replace(year=start.year + 1, month=1) if start.month == 12
+           else start.replace(month=start.month + 1))
+    return start, end
+
+def ensure_attempt_partitions(cursor, months_ahead: int = 1):
+    """Crea las particiones mensuales de exercise_attempts que falten (mes actual y siguientes)"""
+    start, _ = attempt_partition_bounds(datetime.now(timezone.utc).date())
+    created = 0
+    for _ in range(months_ahead + 1):
+        start, end = attempt_partition_bounds(start)
+        name = f"exercise_attempts_{start:%Y_%m}"
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF exercise_attempts "
+                "FOR VALUES FROM (%s) TO (%s)",
+                (start, end)
             )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS challenges (
-                challenge_id SERIAL PRIMARY KEY,
-                description TEXT,
-                start_date TIMESTAMP,
-                end_date TIMESTAMP
+            created += 1
+        start = end
+    return created
+
+async def maintain_attempt_partitions(context: ContextTypes.DEFAULT_TYPE):
+    """Job diario: asegura la partición del mes siguiente antes de necesitarla"""
+    try:
+        created = await run_db(ensure_attempt_partitions)
+        if created:
+            logger.info(f"Particiones de exercise_attempts creadas: {created}")
+    except Exception as e:
+        logger.error(f"Error al crear particiones de intentos: {e}")
+
+# ========================================
+# CONTENIDO (EJERCICIOS Y CURIOSIDADES)
+# ========================================
+
+CONTENT_FILES = (Config.CONTENT_PACK or "ejercicios.json", "curiosidades.json")
+
+def content_mtimes() -> tuple:
+    return tuple(os.stat(path).st_mtime_ns for path in CONTENT_FILES)
+
+def validate_ejercicios(ejercicios):
+    """Comprueba la estructura de ejercicios.json antes de publicarlo"""
+    if not isinstance(ejercicios, dict) or not ejercicios:
+        raise ValueError("ejercicios.json debe ser un objeto con al menos un nivel")
+    for nivel, categorias in ejercicios.items():
+        if not isinstance(categorias, dict) or not categorias:
+            raise ValueError(f"El nivel '{nivel}' no tiene categorías")
+        for categoria, lista in categorias.items():
+            if not isinstance(lista, list):
+                raise ValueError(f"'{nivel}/{categoria}' debe ser una lista")
+            for idx, ejercicio in enumerate(lista):
+                where = f"{nivel}/{categoria}_{idx}"
+                opciones = ejercicio.get("opciones")
+                if not isinstance(ejercicio.get("pregunta"), str) or not ejercicio["pregunta"]:
+                    raise ValueError(f"{where}: falta la pregunta")
+                if not isinstance(opciones, list) or len(opciones) < 2:
+                    raise ValueError(f"{where}: se necesitan al menos dos opciones")
+                if any(not isinstance(opcion, str) or "\0" in opcion for opcion in opciones):
+                    raise ValueError(f"{where}: opción no válida")
+                respuesta = ejercicio.get("respuesta")
+                if not isinstance(respuesta, int) or not 0 <= respuesta < len(opciones):
+                    raise ValueError(f"{where}: respuesta fuera de rango")
+
+def validate_curiosidades(curiosidades):
+    """Comprueba la estructura de curiosidades.json antes de publicarlo"""
+    if not isinstance(curiosidades, list) or not curiosidades:
+        raise ValueError("curiosidades.json debe tener al menos una curiosidad")
+    for idx, curiosidad in enumerate(curiosidades):
+        if not curiosidad.get("texto") or not curiosidad.get("categoria"):
+            raise ValueError(f"Curiosidad {idx}: faltan 'categoria' o 'texto'")
+
+def read_ejercicios(path: str = "ejercicios.json") -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        ejercicios = json.load(f)
+    validate_ejercicios(ejercicios)
+    return ejercicios
+
+def read_content():
+    """Lee y valida el contenido; con content pack, ejercicios.json no se carga"""
+    ejercicios = {} if Config.CONTENT_PACK else read_ejercicios()
+    with open("curiosidades.json", "r", encoding="utf-8") as f:
+        curiosidades = json.load(f)["curiosidades"]
+    validate_curiosidades(curiosidades)
+    return ejercicios, curiosidades
+
+# Carga de recursos
+CONTENT_MTIMES = content_mtimes()
+# Vacío si los ejercicios vienen del content pack (mmap)
+EJERCICIOS, CURIOSIDADES = read_content()
+
+# Cada recarga publica una versión nueva; current_exercise guarda con qué versión se emitió
+CONTENT_VERSION = 1
+content_reload_lock = asyncio.Lock()
+
+# ========================================
+# RECONOCIMIENTO DE RESPUESTAS
+# ========================================
+
+ANSWER_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+def normalize_answer(text: str) -> str:
+    """Minúsculas, sin tildes ni signos de puntuación y con espacios simples"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(ANSWER_PUNCTUATION.sub(" ", text).split())
+
+def typo_limit(length: int) -> int:
+    """Erratas toleradas según la longitud de la respuesta"""
+    if length < 4:
+        return 0
+    return 1 if length < 8 else 2
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """Distancia de edición, o limit + 1 en cuanto se sabe que la supera"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+@dataclass(frozen=True)
+class OptionMatcher:
+    """Opciones de un ejercicio preparadas para reconocer respuestas escritas"""
+    exact: dict   # texto de la opción en minúsculas -> índice
+    keys: tuple   # clave normalizada de cada opción
+    index: dict   # clave normalizada -> índice (sin las claves que comparten varias opciones)
+
+    @classmethod
+    def build(cls, options, keys=None):
+        keys = tuple(keys if keys is not None else (normalize_answer(opcion) for opcion in options))
+        index, repeated = {}, set()
+        for idx, key in enumerate(keys):
+            if key in index:
+                repeated.add(key)
+            elif key:
+                index[key] = idx
+        for key in repeated:
+            del index[key]
+        exact = {opcion.casefold().strip(): idx for idx, opcion in reversed(list(enumerate(options)))}
+        return cls(exact, keys, index)
+
+    def match(self, text: str) -> int:
+        """Índice de la opción que corresponde a la respuesta, o -1"""
+        text = text.strip()
+        # isdecimal y no isdigit: "²" o "①" son dígitos pero int() los rechaza
+        if text.isdecimal():
+            return int(text) - 1
+        idx = self.exact.get(text.casefold())
+        if idx is not None:
+            return idx
+
+        key = normalize_answer(text)
+        idx = self.index.get(key)
+        if idx is not None:
+            return idx
+        if not key:
+            return -1
+
+        # Pocas opciones por ejercicio: basta una pasada acotada por longitud
+        limit = typo_limit(len(key))
+        best, best_idx, tied = limit + 1, -1, False
+        for idx, option_key in enumerate(self.keys):
+            if not option_key:
+                continue
+            distance = bounded_levenshtein(key, option_key, limit)
+            if distance < best:
+                best, best_idx, tied = distance, idx, False
+            elif distance == best and distance <= limit:
+                tied = True
+        return -1 if tied else best_idx
+
+# ========================================
+# EJERCICIOS COMPLETADOS (BITMAP POR NIVEL)
+# ========================================
+
+# Cada ejercicio tiene un ordinal estable dentro de su nivel (tabla exercise_ordinals);
+# users.completed_bitmap guarda un bit por ordinal para el nivel actual del usuario.
+# Numeración de bits igual que get_bit/set_bit de PostgreSQL: bit 0 = LSB del primer byte.
+
+@dataclass(frozen=True)
+class Exercise:
+    """Ejercicio compilado: textos ya escapados para Markdown"""
+    level: str
+    category: str
+    key: str
+    ordinal: int
+    options: tuple
+    answer: int
+    header: str            # "📚 *Ejercicio de ...*" (sin la racha, que cambia por usuario)
+    challenge_header: str  # "🔥 *Reto Diario - ...*"
+    body: str              # pregunta + opciones numeradas
+    matcher: OptionMatcher
+
+@dataclass(frozen=True)
+class ExerciseCatalog:
+    """Catálogo inmutable compilado desde ejercicios.json"""
+    levels: dict        # nivel -> tuple[Exercise] en orden de ordinal
+    by_ordinal: dict    # nivel -> tuple[Exercise | None] indexada por ordinal
+    categories: dict    # nivel -> tuple[tuple[Exercise]] por categoría
+    present: dict       # nivel -> bitmap (bytes) de los ordinales con ejercicio
+
+    def get(self, level: str, ordinal: int):
+        exercises = self.by_ordinal.get(level, ())
+        return exercises[ordinal] if 0 <= ordinal < len(exercises) else None
+
+# Se reemplaza entero al recompilar; los lectores nunca ven un catálogo a medias
+CATALOG = ExerciseCatalog({}, {}, {}, {})
+
+# Marca un ordinal en completed_bitmap, ampliando el bytea con ceros si hace falta
+SET_COMPLETED_BIT = """
+    set_bit(
+        CASE WHEN length(completed_bitmap) > %(byte)s::int THEN completed_bitmap
+             ELSE completed_bitmap || decode(repeat('00', %(byte)s::int + 1 - length(completed_bitmap)), 'hex')
+        END,
+        %(ordinal)s::int, 1
+    )
+"""
+
+def bitmap_has(bitmap: bytes, ordinal: int) -> bool:
+    """Comprueba en O(1) si un ordinal está marcado"""
+    byte = ordinal >> 3
+    return byte < len(bitmap) and bool(bitmap[byte] >> (ordinal & 7) & 1)
+
+def bitmap_from_ordinals(ordinals) -> bytes:
+    """Construye un bitmap con los ordinales indicados"""
+    ordinals = list(ordinals)
+    if not ordinals:
+        return b""
+    bitmap = bytearray(max(ordinals) // 8 + 1)
+    for ordinal in ordinals:
+        bitmap[ordinal >> 3] |= 1 << (ordinal & 7)
+    return bytes(bitmap)
+
+# Byte 0/1 -> dígito binario, para convertir banderas en bitmap sin bucle en Python
+FLAG_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+def bitmap_from_flags(flags: bytes) -> bytes:
+    """Bitmap con el bit i marcado si flags[i] es 1"""
+    if not flags:
+        return b""
+    return int(flags.translate(FLAG_DIGITS)[::-1], 2).to_bytes((len(flags) + 7) // 8, "little")
+
+def unseen_ordinals(present: bytes, completed: bytes) -> int:
+    """Ordinales presentes y sin completar, como entero (operaciones de bits en C)"""
+    return int.from_bytes(present, "little") & ~int.from_bytes(completed, "little")
+
+def next_set_bit(mask: int, start: int) -> int:
+    """Primer bit marcado desde start, volviendo al principio si no hay ninguno después"""
+    tail = mask >> start
+    if tail:
+        return start + (tail & -tail).bit_length() - 1
+    return (mask & -mask).bit_length() - 1
+
+def completed_bit_params(ordinal: int) -> dict:
+    return {"byte": ordinal >> 3, "ordinal": ordinal}
+
+# ========================================
+# SELECCIÓN DE EJERCICIOS NUEVOS (PERMUTACIÓN POR USUARIO)
+# ========================================
+
+# Cada usuario recorre los ordinales del nivel en un orden aleatorio propio: una
+# permutación pseudoaleatoria (red de Feistel) sembrada con (usuario, nivel, ronda).
+# users.exercise_cursor solo avanza: ronda = cursor // slots, posición = cursor % slots.
+# Solo se prueban UNSEEN_SCAN_LIMIT posiciones; si el nivel está casi completado, el
+# ejercicio sale directamente del bitmap de no vistos.
+
+MASK64 = (1 << 64) - 1
+UNSEEN_SCAN_LIMIT = 64
+
+def permutation_keys(user_id: int, nivel: str, ronda: int) -> tuple:
+    digest = hashlib.blake2b(f"{user_id}:{nivel}:{ronda}".encode(), digest_size=32).digest()
+    return struct.unpack("<4Q", digest)
+
+def permute_index(i: int, n: int, keys: tuple) -> int:
+    """Biyección pseudoaleatoria sobre [0, n) (Feistel + cycle walking)"""
+    half = max(1, ((n - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    while True:
+        left, right = i >> half, i & mask
+        for key in keys:
+            x = (right ^ key) * 0x9E3779B97F4A7C15 & MASK64
+            left, right = right, left ^ ((x ^ (x >> 29)) & mask)
+        i = (left << half) | right
+        # El dominio de Feistel es como mucho 4n: pocas vueltas de media
+        if i < n:
+            return i
+
+def next_unseen_exercise(user_id: int, nivel: str, cursor: int, completed: bytes):
+    """Siguiente ejercicio no completado: (ejercicio, cursor nuevo, ¿completó el nivel?)"""
+    slots = CATALOG.by_ordinal[nivel]
+    present = CATALOG.present[nivel]
+    n = len(slots)
+    if not len(CATALOG.levels[nivel]):
+        raise LookupError(f"El nivel '{nivel}' no tiene ejercicios")
+
+    ronda = cursor // n
+    keys = permutation_keys(user_id, nivel, ronda)
+    level_done = False
+    for _ in range(UNSEEN_SCAN_LIMIT):
+        if cursor // n != ronda:
+            ronda = cursor // n
+            keys = permutation_keys(user_id, nivel, ronda)
+            # Al dar la vuelta, los ejercicios sin responder vuelven a salir en la ronda
+            # nueva; el progreso solo se reinicia si ya estaban todos completados
+            if not level_done and not unseen_ordinals(present, completed):
+                level_done, completed = True, b""
+        ordinal = permute_index(cursor % n, n, keys)
+        cursor += 1
+        if bitmap_has(present, ordinal) and not bitmap_has(completed, ordinal):
+            return slots[ordinal], cursor, level_done
+
+    # Quedan pocos sin completar (o hay muchos huecos): se elige entre los no vistos
+    # a partir de una posición de la permutación, sin recorrerla
+    unseen = unseen_ordinals(present, completed)
+    if not unseen:
+        level_done = True
+        unseen = int.from_bytes(present, "little")
+    ordinal = next_set_bit(unseen, permute_index(cursor % n, n, keys))
+    return slots[ordinal], cursor, level_done
+
+def round_start_cursor(cursor: int, nivel: str) -> int:
+    """Cursor al inicio de la próxima ronda (al cambiar de nivel)"""
+    n = len(CATALOG.by_ordinal.get(nivel, ())) or 1
+    return (cursor // n + 1) * n
+
+def sync_exercise_ordinals_tx(cursor, ejercicios: dict):
+    # Serializar entre workers que arrancan a la vez
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('exercise_ordinals'))")
+    cursor.execute("SELECT level, exercise_key, ordinal FROM exercise_ordinals")
+    ordinals = {}
+    for level, key, ordinal in cursor.fetchall():
+        ordinals.setdefault(level, {})[key] = ordinal
+
+    # Los ejercicios nuevos reciben el siguiente ordinal libre: nunca se reutilizan
+    nuevos = []
+    for nivel, categorias in ejercicios.items():
+        known = ordinals.setdefault(nivel, {})
+        next_ordinal = max(known.values(), default=-1) + 1
+        for categoria, lista in categorias.items():
+            for idx in range(len(lista)):
+                key = f"{categoria}_{idx}"
+                if key not in known:
+                    known[key] = next_ordinal
+                    nuevos.append((nivel, key, next_ordinal))
+                    next_ordinal += 1
+
+    if nuevos:
+        execute_values(
+            cursor,
+            "INSERT INTO exercise_ordinals (level, exercise_key, ordinal) VALUES %s",
+            nuevos
+        )
+    return ordinals
+
+def compile_exercise(nivel: str, categoria: str, key: str, ordinal: int, ejercicio: dict) -> Exercise:
+    categoria_safe = sanitize_text(categoria)
+    body = sanitize_text(ejercicio["pregunta"]) + "\n\n" + "".join(
+        f"{opt_idx + 1}. {sanitize_text(opcion)}\n"
+        for opt_idx, opcion in enumerate(ejercicio["opciones"])
+    )
+    return Exercise(
+        level=nivel,
+        category=categoria,
+        key=key,
+        ordinal=ordinal,
+        options=tuple(ejercicio["opciones"]),
+        answer=ejercicio["respuesta"],
+        header=f"📚 *Ejercicio de {categoria_safe} ({sanitize_text(nivel)})*\n",
+        challenge_header=f"🔥 *Reto Diario - {categoria_safe} ({nivel.capitalize()})*\n\n",
+        body=body,
+        matcher=OptionMatcher.build(ejercicio["opciones"])
+    )
+
+def compile_catalog(ejercicios: dict, ordinals: dict) -> ExerciseCatalog:
+    """Compila ejercicios.json con sus ordinales en un ExerciseCatalog"""
+    levels, by_ordinal, categories, present = {}, {}, {}, {}
+    for nivel, categorias in ejercicios.items():
+        per_category = []
+        for categoria, lista in categorias.items():
+            per_category.append(tuple(
+                compile_exercise(nivel, categoria, f"{categoria}_{idx}",
+                                 ordinals[nivel][f"{categoria}_{idx}"], ejercicio)
+                for idx, ejercicio in enumerate(lista)
+            ))
+        exercises = sorted((ex for grupo in per_category for ex in grupo), key=lambda ex: ex.ordinal)
+
+        # Los ordinales de ejercicios retirados quedan como huecos (None)
+        slots = [None] * (exercises[-1].ordinal + 1 if exercises else 0)
+        for ex in exercises:
+            slots[ex.ordinal] = ex
+
+        levels[nivel] = tuple(exercises)
+        by_ordinal[nivel] = tuple(slots)
+        categories[nivel] = tuple(grupo for grupo in per_category if grupo)
+        present[nivel] = bitmap_from_ordinals(ex.ordinal for ex in exercises)
+    return ExerciseCatalog(levels, by_ordinal, categories, present)
+
+def load_exercise_index():
+    """Asigna ordinales estables a los ejercicios y compila CATALOG (o abre el content pack)"""
+    global CATALOG
+    if Config.CONTENT_PACK:
+        # Los ordinales ya se sincronizaron al construir el pack
+        CATALOG = open_content_pack(Config.CONTENT_PACK)
+    else:
+        with db_cursor() as cursor:
+            ordinals = sync_exercise_ordinals_tx(cursor, EJERCICIOS)
+        CATALOG = compile_catalog(EJERCICIOS, ordinals)
+
+    logger.info(
+        "Catálogo " + ("mapeado" if Config.CONTENT_PACK else "compilado") + ": "
+        + ", ".join(f"{nivel}={len(lista)}" for nivel, lista in CATALOG.levels.items())
+    )
+
+# ========================================
+# CONTENT PACK (BINARIO, MMAP)
+# ========================================
+
+# Formato (little-endian), todos los offsets relativos al inicio de su sección:
+#   cabecera | niveles | categorías | ordinales (u32) | registros | tabla de cadenas
+# Cada nivel apunta a su tabla de registros (uno por ordinal, huecos incluidos), a su
+# lista densa de ordinales y a sus categorías; cada categoría, a su lista de ordinales.
+# Las cadenas son (offset, longitud) en UTF-8; las cabeceras repetidas se guardan una vez.
+PACK_MAGIC = b"SPNPACK\0"
+PACK_FORMAT = 2
+PACK_HEADER = struct.Struct("<8sIIQQQQQ")  # magic, formato, niveles, offsets de las 5 secciones
+PACK_LEVEL = struct.Struct("<QIIQIIIQ")    # nombre, slots, primer registro, categorías, ordinales densos
+PACK_CATEGORY = struct.Struct("<QIIQ")     # nombre, nº de ordinales, primer ordinal
+# key, categoría, header, reto, body, opciones, claves normalizadas, respuesta, presente
+PACK_RECORD = struct.Struct("<QIQIQIQIQIQIQIBB")
+PACK_ORDINAL = struct.Struct("<I")
+
+class StringTable:
+    """Tabla de cadenas del content pack"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self._interned = {}
+
+    def add(self, text: str, intern: bool = False):
+        if intern and text in self._interned:
+            return self._interned[text]
+        raw = text.encode("utf-8")
+        ref = (len(self.data), len(raw))
+        self.data += raw
+        if intern:
+            self._interned[text] = ref
+        return ref
+
+def write_content_pack(path: str, ejercicios: dict, ordinals: dict):
+    """Compila ejercicios.json con sus ordinales en un content pack"""
+    strings = StringTable()
+    levels, categories, ordinal_lists, records = bytearray(), bytearray(), bytearray(), bytearray()
+    n_categories = n_ordinals = n_records = 0
+    empty = PACK_RECORD.pack(*([0] * 14), 0, 0)
+
+    for nivel, categorias in ejercicios.items():
+        slots = {}
+        first_category = n_categories
+        for categoria, lista in categorias.items():
+            category_ordinals = []
+            for idx, ejercicio in enumerate(lista):
+                ex = compile_exercise(nivel, categoria, f"{categoria}_{idx}",
+                                      ordinals[nivel][f"{categoria}_{idx}"], ejercicio)
+                slots[ex.ordinal] = PACK_RECORD.pack(
+                    *strings.add(ex.key),
+                    *strings.add(ex.category, intern=True),
+                    *strings.add(ex.header, intern=True),
+                    *strings.add(ex.challenge_header, intern=True),
+                    *strings.add(ex.body),
+                    *strings.add("\0".join(ex.options)),
+                    *strings.add("\0".join(ex.matcher.keys)),
+                    ex.answer, 1
+                )
+                category_ordinals.append(ex.ordinal)
+            if not category_ordinals:
+                continue
+            categories += PACK_CATEGORY.pack(
+                *strings.add(categoria, intern=True), len(category_ordinals), n_ordinals
             )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS feedback (
-                feedback_id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                message TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            for ordinal in category_ordinals:
+                ordinal_lists += PACK_ORDINAL.pack(ordinal)
+            n_categories += 1
+            n_ordinals += len(category_ordinals)
+
+        slot_count = max(slots, default=-1) + 1
+        first_record = n_records
+        for ordinal in range(slot_count):
+            records += slots.get(ordinal, empty)
+        n_records += slot_count
+
+        dense = sorted(slots)
+        levels += PACK_LEVEL.pack(
+            *strings.add(nivel, intern=True), slot_count, first_record,
+            n_categories - first_category, first_category, len(dense), n_ordinals
+        )
+        for ordinal in dense:
+            ordinal_lists += PACK_ORDINAL.pack(ordinal)
+        n_ordinals += len(dense)
+
+    offset = PACK_HEADER.size
+    sections = []
+    for section in (levels, categories, ordinal_lists, records, strings.data):
+        sections.append(offset)
+        offset += len(section)
+
+    # Escritura atómica: los procesos que ya tienen el pack mapeado siguen con el fichero anterior
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_FORMAT, len(ejercicios), *sections))
+        for section in (levels, categories, ordinal_lists, records, strings.data):
+            f.write(section)
+    os.replace(tmp_path, path)
+    return offset
+
+class PackedSlots(Sequence):
+    """Registros de un nivel indexados por ordinal (None en los huecos)"""
+
+    def __init__(self, pack, level: str, first_record: int, count: int):
+        self._pack = pack
+        self._level = level
+        self._base = pack.records + first_record * PACK_RECORD.size
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, ordinal):
+        if not 0 <= ordinal < self._count:
+            raise IndexError(ordinal)
+        fields = PACK_RECORD.unpack_from(self._pack.buf, self._base + ordinal * PACK_RECORD.size)
+        if not fields[15]:
+            return None
+        text = self._pack.text
+        options = tuple(text(fields[10], fields[11]).split("\0"))
+        return Exercise(
+            level=self._level,
+            category=text(fields[2], fields[3]),
+            key=text(fields[0], fields[1]),
+            ordinal=ordinal,
+            options=options,
+            answer=fields[14],
+            header=text(fields[4], fields[5]),
+            challenge_header=text(fields[6], fields[7]),
+            body=text(fields[8], fields[9]),
+            matcher=OptionMatcher.build(options, text(fields[12], fields[13]).split("\0"))
+        )
+
+class PackedOrdinals(Sequence):
+    """Lista de ordinales del pack vista como secuencia de ejercicios"""
+
+    def __init__(self, slots: PackedSlots, first: int, count: int):
+        self._slots = slots
+        self._base = slots._pack.ordinals + first * PACK_ORDINAL.size
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        (ordinal,) = PACK_ORDINAL.unpack_from(self._slots._pack.buf, self._base + i * PACK_ORDINAL.size)
+        return self._slots[ordinal]
+
+class ContentPack:
+    """Content pack abierto con mmap: las páginas se comparten entre procesos"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, n_levels, levels, categories, self.ordinals, self.records, self.strings = (
+            PACK_HEADER.unpack_from(self.buf, 0)
+        )
+        if magic != PACK_MAGIC or fmt != PACK_FORMAT:
+            raise ValueError(f"{path} no es un content pack válido (formato {PACK_FORMAT})")
+
+        self.levels, self.by_ordinal, self.categories, self.present = {}, {}, {}, {}
+        for i in range(n_levels):
+            name_off, name_len, slot_count, first_record, n_cats, first_cat, n_dense, first_dense = (
+                PACK_LEVEL.unpack_from(self.buf, levels + i * PACK_LEVEL.size)
             )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS blocked_users (
-                user_id BIGINT PRIMARY KEY,
-                blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            nivel = self.text(name_off, name_len)
+            slots = PackedSlots(self, nivel, first_record, slot_count)
+            self.by_ordinal[nivel] = slots
+            # Último byte de cada registro = presente: una lectura con paso, sin decodificar
+            start = self.records + first_record * PACK_RECORD.size + PACK_RECORD.size - 1
+            self.present[nivel] = bitmap_from_flags(
+                self.buf[start:start + slot_count * PACK_RECORD.size:PACK_RECORD.size]
             )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS achievements (
-                achievement_id SERIAL PRIMARY KEY,
-                name VARCHAR(50) UNIQUE,
-                description TEXT,
-                icon VARCHAR(20)
+            self.levels[nivel] = PackedOrdinals(slots, first_dense, n_dense)
+            groups = []
+            for c in range(first_cat, first_cat + n_cats):
+                _, _, count, first = PACK_CATEGORY.unpack_from(self.buf, categories + c * PACK_CATEGORY.size)
+                groups.append(PackedOrdinals(slots, first, count))
+            self.categories[nivel] = tuple(groups)
+
+    def text(self, offset: int, length: int) -> str:
+        start = self.strings + offset
+        return self.buf[start:start + length].decode("utf-8")
+
+def open_content_pack(path: str) -> ExerciseCatalog:
+    """Abre un content pack como ExerciseCatalog sin cargar los ejercicios en memoria"""
+    pack = ContentPack(path)
+    return ExerciseCatalog(pack.levels, pack.by_ordinal, pack.categories, pack.present)
+
+def prepare_content():
+    """Lee, valida y compila una versión nueva del contenido (en db_executor)"""
+    mtimes = content_mtimes()
+    ejercicios, curiosidades = read_content()
+
+    if Config.CONTENT_PACK:
+        catalog = open_content_pack(Config.CONTENT_PACK)
+    else:
+        with db_cursor() as cursor:
+            ordinals = sync_exercise_ordinals_tx(cursor, ejercicios)
+        catalog = compile_catalog(ejercicios, ordinals)
+
+    # Los usuarios tienen guardado su nivel: no se puede retirar uno
+    missing = set(CATALOG.levels) - set(catalog.levels)
+    if missing:
+        raise ValueError(f"Faltan niveles en el contenido nuevo: {', '.join(sorted(missing))}")
+    return ejercicios, curiosidades, catalog, mtimes
+
+async def reload_content() -> int:
+    """Recarga el contenido sin reiniciar y lo publica de una vez"""
+    global EJERCICIOS, CURIOSIDADES, CATALOG, CONTENT_MTIMES, CONTENT_VERSION, daily_challenge
+    async with content_reload_lock:
+        loop = asyncio.get_running_loop()
+        try:
+            ejercicios, curiosidades, catalog, mtimes = await loop.run_in_executor(
+                db_executor, prepare_content
             )
-        """)
+        except Exception:
+            # No reintentar la misma versión defectuosa en cada comprobación
+            CONTENT_MTIMES = content_mtimes()
+            raise
+
+        # Sin await entre las asignaciones: ningún handler ve una mezcla de versiones
+        EJERCICIOS, CURIOSIDADES, CATALOG = ejercicios, curiosidades, catalog
+        CONTENT_MTIMES = mtimes
+        # El mensaje del reto se vuelve a renderizar con el contenido nuevo
+        daily_challenge = None
+        CONTENT_VERSION += 1
+
+    logger.info(
+        f"Contenido recargado (versión {CONTENT_VERSION}): "
+        + ", ".join(f"{nivel}={len(lista)}" for nivel, lista in catalog.levels.items())
+        + f", curiosidades={len(curiosidades)}"
+    )
+    return CONTENT_VERSION
+
+async def watch_content(context: ContextTypes.DEFAULT_TYPE):
+    """Job periódico: recarga el contenido si cambiaron los ficheros"""
+    try:
+        if content_mtimes() == CONTENT_MTIMES:
+            return
+        await reload_content()
+    except Exception as e:
+        logger.error(f"Contenido nuevo rechazado: {e}")
+
+# ========================================
+# MIGRACIONES DE ESQUEMA
+# ========================================
+
+# Minuto del día en UTC de la hora local reminder_time en la zona timezone (con el
+# horario de verano de hoy; refresh_reminder_minutes lo recalcula cada día)
+REMINDER_UTC_MINUTE = """
+    (EXTRACT(HOUR FROM ((CURRENT_DATE + reminder_time) AT TIME ZONE timezone) AT TIME ZONE 'UTC') * 60
+     + EXTRACT(MINUTE FROM ((CURRENT_DATE + reminder_time) AT TIME ZONE timezone) AT TIME ZONE 'UTC'))::smallint
+"""
+
+def migrate_completed_bitmap_tx(cursor):
+    """Convierte la antigua lista users.completed_exercises en completed_bitmap"""
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'users' AND column_name = 'completed_exercises'
+        """
+    )
+    if not cursor.fetchone():
+        return
+
+    # Con content pack los ejercicios no están cargados: las claves salen de ejercicios.json
+    ordinals = sync_exercise_ordinals_tx(cursor, EJERCICIOS or read_ejercicios())
+    cursor.execute(
+        "SELECT user_id, level, completed_exercises FROM users WHERE completed_exercises <> ''"
+    )
+    rows = []
+    for user_id, level, completed in cursor.fetchall():
+        level_ordinals = ordinals.get((level or "principiante").lower(), {})
+        marked = [level_ordinals[key] for key in completed.split(",") if key in level_ordinals]
+        rows.append((user_id, psycopg2.Binary(bitmap_from_ordinals(marked))))
+
+    if rows:
+        execute_values(
+            cursor,
+            """
+            UPDATE users SET completed_bitmap = v.bitmap
+            FROM (VALUES %s) AS v(user_id, bitmap)
+            WHERE users.user_id = v.user_id
+            """,
+            rows
+        )
+    cursor.execute("ALTER TABLE users DROP COLUMN completed_exercises")
+    logger.info(f"Migrados {len(rows)} usuarios a completed_bitmap")
+
+# (versión, descripción, pasos). Cada paso es SQL o una función que recibe el cursor.
+# Las migraciones ya publicadas no se modifican: los cambios van en una versión nueva.
+MIGRATIONS = [
+    (1, "Tablas iniciales", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username VARCHAR(50),
+            level VARCHAR(20) DEFAULT 'principiante',
+            exercises INT DEFAULT 0,
+            referrals INT DEFAULT 0,
+            challenge_score INT DEFAULT 0,
+            completed_exercises TEXT DEFAULT '',
+            streak_days INT DEFAULT 0,
+            last_practice DATE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS challenges (
+            challenge_id SERIAL PRIMARY KEY,
+            description TEXT,
+            start_date TIMESTAMP,
+            end_date TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS feedback (
+            feedback_id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS blocked_users (
+            user_id BIGINT PRIMARY KEY,
+            blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS achievements (
+            achievement_id SERIAL PRIMARY KEY,
+            name VARCHAR(50) UNIQUE,
+            description TEXT,
+            icon VARCHAR(20)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            user_id BIGINT,
+            achievement_id INT,
+            earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, achievement_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_reminders (
+            user_id BIGINT PRIMARY KEY,
+            reminder_time TIME,
+            timezone VARCHAR(50)
+        )
+        """,
+    ]),
+    (2, "Ejercicios completados como bitmap", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS completed_bitmap BYTEA NOT NULL DEFAULT ''",
+        """
+        CREATE TABLE IF NOT EXISTS exercise_ordinals (
+            level VARCHAR(20),
+            exercise_key VARCHAR(100),
+            ordinal INT NOT NULL,
+            PRIMARY KEY (level, exercise_key),
+            UNIQUE (level, ordinal)
+        )
+        """,
+        migrate_completed_bitmap_tx,
+    ]),
+    (3, "Notificaciones de blocked_users", [
+        # Avisar a los workers de cada cambio en blocked_users (caché en memoria)
+        """
+        CREATE OR REPLACE FUNCTION notify_blocked_users() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('blocked_users', 'reload');
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                PERFORM pg_notify('blocked_users', 'unblock:' || OLD.user_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_notify('blocked_users', 'block:' || NEW.user_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        DROP TRIGGER IF EXISTS blocked_users_notify ON blocked_users;
+        CREATE TRIGGER blocked_users_notify
+            AFTER INSERT OR UPDATE OR DELETE ON blocked_users
+            FOR EACH ROW EXECUTE FUNCTION notify_blocked_users();
+        DROP TRIGGER IF EXISTS blocked_users_notify_truncate ON blocked_users;
+        CREATE TRIGGER blocked_users_notify_truncate
+            AFTER TRUNCATE ON blocked_users
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_blocked_users();
+        """,
+    ]),
+    (4, "Índices secundarios y restricciones", [
+        # user_achievements(user_id) ya está cubierto por su clave primaria (user_id, achievement_id)
+        "CREATE INDEX IF NOT EXISTS idx_feedback_user_id ON feedback (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_last_practice ON users (last_practice)",
+        # NOT VALID: no revisa filas antiguas ni bloquea la tabla mientras lo haría
+        """
+        ALTER TABLE user_achievements
+            ADD CONSTRAINT fk_user_achievements_user
+                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE NOT VALID,
+            ADD CONSTRAINT fk_user_achievements_achievement
+                FOREIGN KEY (achievement_id) REFERENCES achievements (achievement_id)
+                ON DELETE CASCADE NOT VALID
+        """,
+        """
+        ALTER TABLE feedback
+            ADD CONSTRAINT fk_feedback_user
+                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE SET NULL NOT VALID
+        """,
+        """
+        ALTER TABLE users
+            ADD CONSTRAINT chk_users_level
+                CHECK (level IN ('principiante', 'intermedio', 'avanzado')) NOT VALID,
+            ADD CONSTRAINT chk_users_counters
+                CHECK (exercises >= 0 AND referrals >= 0 AND challenge_score >= 0
+                       AND streak_days >= 0) NOT VALID
+        """,
+    ]),
+    (5, "Registro de intentos de ejercicios", [
+        """
+        CREATE TABLE IF NOT EXISTS exercise_attempts (
+            user_id BIGINT NOT NULL,
+            exercise_id VARCHAR(100) NOT NULL,
+            level VARCHAR(20),
+            chosen_option SMALLINT,
+            is_correct BOOLEAN NOT NULL,
+            latency_ms INT,
+            attempted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        ) PARTITION BY RANGE (attempted_at)
+        """,
+        # Red de seguridad si el job de particiones no llegó a tiempo
+        "CREATE TABLE IF NOT EXISTS exercise_attempts_default PARTITION OF exercise_attempts DEFAULT",
+        """
+        CREATE INDEX IF NOT EXISTS idx_exercise_attempts_user
+            ON exercise_attempts (user_id, attempted_at)
+        """,
+    ]),
+    (6, "Cursor de ejercicios nuevos por usuario", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS exercise_cursor BIGINT NOT NULL DEFAULT 0",
+    ]),
+    (7, "Repaso espaciado (SM-2)", [
+        """
+        CREATE TABLE IF NOT EXISTS review_items (
+            user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            level VARCHAR(20) NOT NULL,
+            ordinal INT NOT NULL,
+            repetitions INT NOT NULL DEFAULT 0,
+            interval_days INT NOT NULL DEFAULT 0,
+            ease REAL NOT NULL DEFAULT 2.5,
+            due_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (user_id, level, ordinal)
+        )
+        """,
+        # El próximo repaso pendiente es la primera entrada del índice para (usuario, nivel)
+        """
+        CREATE INDEX IF NOT EXISTS idx_review_items_due
+            ON review_items (user_id, level, due_at)
+        """,
+    ]),
+    (8, "Reto diario en challenges", [
+        """
+        ALTER TABLE challenges
+            ADD COLUMN IF NOT EXISTS challenge_date DATE,
+            ADD COLUMN IF NOT EXISTS level VARCHAR(20),
+            ADD COLUMN IF NOT EXISTS ordinal INT,
+            ADD COLUMN IF NOT EXISTS exercise_key VARCHAR(100)
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_challenges_date ON challenges (challenge_date)",
+        """
+        CREATE TABLE IF NOT EXISTS challenge_completions (
+            challenge_id INT REFERENCES challenges (challenge_id) ON DELETE CASCADE,
+            user_id BIGINT REFERENCES users (user_id) ON DELETE CASCADE,
+            completed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (challenge_id, user_id)
+        )
+        """,
+    ]),
+    (9, "Rotación de curiosidades por usuario", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS curiosity_offset BIGINT NOT NULL DEFAULT 0",
+    ]),
+    (10, "Envíos masivos reanudables", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL UNIQUE,
+            audience VARCHAR(50) NOT NULL,
+            message TEXT NOT NULL,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INT NOT NULL DEFAULT 0,
+            failed INT NOT NULL DEFAULT 0,
+            locked_until TIMESTAMPTZ,
+            owner VARCHAR(32),
+            started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at TIMESTAMPTZ
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_pending
+            ON broadcasts (locked_until) WHERE finished_at IS NULL
+        """,
+    ]),
+    (11, "Recordatorios por zona horaria", [
+        "ALTER TABLE user_reminders ADD COLUMN IF NOT EXISTS utc_minute SMALLINT",
+        "ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS audience_param INT",
+        # Al borrar un usuario se borra su recordatorio (antes quedaban huérfanos)
+        "DELETE FROM user_reminders r WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = r.user_id)",
+        """
+        ALTER TABLE user_reminders
+            ADD CONSTRAINT fk_user_reminders_user
+                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE NOT VALID
+        """,
+        # Todos los usuarios existentes conservan el recordatorio de las 09:00 UTC
+        """
+        INSERT INTO user_reminders (user_id, reminder_time, timezone)
+        SELECT user_id, '09:00', 'UTC' FROM users
+        ON CONFLICT (user_id) DO NOTHING
+        """,
+        f"""
+        UPDATE user_reminders SET utc_minute = {REMINDER_UTC_MINUTE}
+        WHERE reminder_time IS NOT NULL
+        """,
+        # Cada tick solo lee los usuarios de su minuto
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_reminders_minute
+            ON user_reminders (utc_minute, user_id) WHERE utc_minute IS NOT NULL
+        """,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(cursor) -> int:
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def migrate():
+    """Aplica las migraciones pendientes, cada una en su propia transacción"""
+    with db_cursor() as cursor:
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_achievements (
-                user_id BIGINT,
-                achievement_id INT,
-                earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, achievement_id)
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_reminders (
-                user_id BIGINT PRIMARY KEY,
-                reminder_time TIME,
-                timezone VARCHAR(50)
+
+    for version, description, steps in MIGRATIONS:
+        with db_cursor() as cursor:
+            # Dos procesos migrando a la vez: el segundo espera y ve la versión ya aplicada
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('schema_version'))")
+            if get_schema_version(cursor) >= version:
+                continue
+            logger.info(f"Aplicando migración {version}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (version, description)
             )
-        """)
 
-# Inicializar el pool de conexiones y crear tablas
-init_db_pool()
-create_tables()
+    with db_cursor() as cursor:
+        ensure_attempt_partitions(cursor)
 
-# Carga de recursos
-with open("ejercicios.json", "r", encoding="utf-8") as f:
-    EJERCICIOS = json.load(f)
+    logger.info(f"Esquema en la versión {SCHEMA_VERSION}")
 
-with open("curiosidades.json", "r", encoding="utf-8") as f:
-    CURIOSIDADES = json.load(f)["curiosidades"]
+def ensure_schema():
+    """Comprueba la versión del esquema al arrancar; solo ejecuta DDL si DB_AUTO_MIGRATE"""
+    with db_cursor() as cursor:
+        current = get_schema_version(cursor)
+    if current >= SCHEMA_VERSION:
+        return
+    if Config.DB_AUTO_MIGRATE:
+        migrate()
+        return
+    raise SystemExit(
+        f"El esquema está en la versión {current} y el bot necesita la {SCHEMA_VERSION}: "
+        "ejecuta 'python spanishDailybot.py migrate'"
+    )
 
 # Estados para la conversación
 FEEDBACK = 1
@@ -205,79 +1808,277 @@ def generate_progress_bar(percentage: int) -> str:
 # MANEJO DE USUARIOS Y PROGRESO
 # ========================================
 
-async def check_user_blocked(user_id: int) -> bool:
-    """Verifica si un usuario está bloqueado"""
-    try:
-        with db_cursor() as cursor:
-            cursor.execute("SELECT 1 FROM blocked_users WHERE user_id = %s", (user_id,))
-            return bool(cursor.fetchone())
-    except Exception as e:
-        logger.error(f"Error al verificar bloqueo: {e}")
-        return False
+# Usuarios bloqueados en memoria; se mantiene al día con LISTEN/NOTIFY
+BLOCKED_USERS = set()
+BLOCKED_USERS_CHANNEL = "blocked_users"
+
+def check_user_blocked(user_id: int) -> bool:
+    """Verifica si un usuario está bloqueado (sin consultar la base de datos)"""
+    return user_id in BLOCKED_USERS
+
+def reload_blocked_users(cursor):
+    global BLOCKED_USERS
+    cursor.execute("SELECT user_id FROM blocked_users")
+    # Reemplazo atómico: los lectores ven el conjunto viejo o el nuevo, nunca uno a medias
+    BLOCKED_USERS = {row[0] for row in cursor.fetchall()}
+    logger.info(f"Usuarios bloqueados cargados: {len(BLOCKED_USERS)}")
+
+def apply_blocked_notification(payload: str, cursor):
+    action, _, user_id = payload.partition(":")
+    if action == "block":
+        BLOCKED_USERS.add(int(user_id))
+    elif action == "unblock":
+        BLOCKED_USERS.discard(int(user_id))
+    else:
+        reload_blocked_users(cursor)
 
-async def register_user(user_id: int, username: str):
-    """Registra un nuevo usuario en la base de datos"""
-    try:
-        with db_cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO users (user_id, username) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING",
-                (user_id, username)
-            )
-    except Exception as e:
-        logger.error(f"Error al registrar usuario: {e}")
+class BlockedUsersListener(threading.Thread):
+    """Escucha las notificaciones de blocked_users con una conexión propia (fuera del pool)"""
 
-async def update_streak(user_id: int):
-    """Actualiza la racha de días consecutivos de práctica"""
-    try:
-        today = datetime.now().date()
-        with db_cursor() as cursor:
-            cursor.execute(
-                "SELECT last_practice, streak_days FROM users WHERE user_id = %s",
-                (user_id,)
-            )
-            result = cursor.fetchone()
+    def __init__(self, poll_interval: float = 5.0, retry_delay: float = 5.0):
+        super().__init__(name="blocked-users-listener", daemon=True)
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self._stop_event = threading.Event()
 
-            if result:
-                last_practice, streak_days = result
-                new_streak = 1 if not last_practice or (today - last_practice).days > 1 else streak_days + 1
+    def stop(self):
+        self._stop_event.set()
 
-                cursor.execute(
-                    "UPDATE users SET streak_days = %s, last_practice = %s WHERE user_id = %s",
-                    (new_streak, today, user_id)
-                )
-                return new_streak
-    except Exception as e:
-        logger.error(f"Error al actualizar racha: {e}")
-    return 0
+    def run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**Config.DB_CONFIG)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {BLOCKED_USERS_CHANNEL}")
+                    # Recargar tras LISTEN: cubre los cambios hechos mientras no escuchábamos
+                    reload_blocked_users(cursor)
+
+                    while not self._stop_event.is_set():
+                        if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            apply_blocked_notification(conn.notifies.pop(0).payload, cursor)
+            except Exception as e:
+                logger.error(f"Error en el listener de bloqueos: {e}")
+                self._stop_event.wait(self.retry_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+blocked_users_listener = None
+
+def start_blocked_users_listener():
+    """Carga los bloqueos y arranca el hilo que los mantiene actualizados"""
+    global blocked_users_listener
+    with db_cursor() as cursor:
+        reload_blocked_users(cursor)
+    blocked_users_listener = BlockedUsersListener()
+    blocked_users_listener.start()
+
+# Racha calculada en SQL: repetir el mismo día no la incrementa, ayer la continúa
+START_PRACTICE = register_query("start_practice", """
+    UPDATE users
+    SET streak_days = CASE
+            WHEN last_practice = CURRENT_DATE THEN GREATEST(streak_days, 1)
+            WHEN last_practice = CURRENT_DATE - 1 THEN streak_days + 1
+            ELSE 1
+        END,
+        last_practice = CURRENT_DATE
+    WHERE user_id = %(user_id)s
+    RETURNING streak_days, level, completed_bitmap
+""")
+
+async def start_practice(user_id: int):
+    """Actualiza la racha y devuelve (racha, nivel, completed_bitmap) en un solo viaje"""
+    row = await db_fetchone(START_PRACTICE, {"user_id": user_id})
+    if not row:
+        return 0, "principiante", b""
+    streak, level, completed = row
+    return streak, level.lower(), bytes(completed) if completed else b""
+
+# Logros que el bot otorga: siempre existen en la tabla achievements
+SEED_ACHIEVEMENTS = {
+    "Nuevo Estudiante": ("Comenzaste tu práctica diaria de español", "🌱"),
+    "Aprendiz": ("Completaste 10 ejercicios", "📘"),
+    "Experto": ("Completaste 50 ejercicios", "🎓"),
+    "Embajador": ("Invitaste a un amigo al bot", "🤝"),
+}
+
+# Catálogo en memoria: achievement_id -> (nombre, descripción, icono) y nombre -> achievement_id
+ACHIEVEMENT_CATALOG = {}
+ACHIEVEMENT_IDS = {}
+
+def load_achievement_catalog():
+    """Crea los logros del código que falten y carga el catálogo completo en memoria"""
+    with db_cursor() as cursor:
+        execute_values(
+            cursor,
+            "INSERT INTO achievements (name, description, icon) VALUES %s ON CONFLICT (name) DO NOTHING",
+            [(name, description, icon) for name, (description, icon) in SEED_ACHIEVEMENTS.items()]
+        )
+        cursor.execute("SELECT achievement_id, name, description, icon FROM achievements")
+        rows = cursor.fetchall()
+
+    ACHIEVEMENT_CATALOG.clear()
+    ACHIEVEMENT_IDS.clear()
+    for achievement_id, name, description, icon in rows:
+        ACHIEVEMENT_CATALOG[achievement_id] = (name, description, icon)
+        ACHIEVEMENT_IDS[name] = achievement_id
+
+GRANT_ACHIEVEMENT = register_query("grant_achievement", """
+    INSERT INTO user_achievements (user_id, achievement_id)
+    VALUES (%(user_id)s::bigint, %(achievement_id)s::int)
+    ON CONFLICT DO NOTHING
+    RETURNING achievement_id
+""")
 
 async def grant_achievement(user_id: int, achievement_name: str):
-    """Otorga un logro a un usuario"""
+    """Otorga un logro a un usuario; devuelve True solo si es nuevo"""
+    achievement_id = ACHIEVEMENT_IDS.get(achievement_name)
+    if achievement_id is None:
+        logger.error(f"Logro desconocido: {achievement_name}")
+        return False
     try:
-        with db_cursor() as cursor:
-            # Obtener ID del logro
-            cursor.execute(
-                "SELECT achievement_id FROM achievements WHERE name = %s",
-                (achievement_name,)
-            )
-            achievement_id = cursor.fetchone()
-
-            if achievement_id:
-                achievement_id = achievement_id[0]
-                # Verificar si el usuario ya tiene el logro
-                cursor.execute(
-                    "SELECT 1 FROM user_achievements WHERE user_id = %s AND achievement_id = %s",
-                    (user_id, achievement_id)
-                )
-                if not cursor.fetchone():
-                    cursor.execute(
-                        "INSERT INTO user_achievements (user_id, achievement_id) VALUES (%s, %s)",
-                        (user_id, achievement_id)
-                    )
-                    return True
+        row = await db_fetchone(
+            GRANT_ACHIEVEMENT,
+            {"user_id": user_id, "achievement_id": achievement_id}
+        )
+        return row is not None
     except Exception as e:
         logger.error(f"Error al otorgar logro: {e}")
     return False
 
+# ========================================
+# CONTEXTO POR UPDATE
+# ========================================
+
+@dataclass
+class UserProfile:
+    """Fila de users cargada una vez por update"""
+    user_id: int
+    username: str
+    level: str
+    exercises: int
+    referrals: int
+    challenge_score: int
+    streak_days: int
+    last_practice: date
+    completed_bitmap: bytes
+    exercise_cursor: int
+    curiosity_offset: int
+    is_new: bool
+    practiced_today: bool
+    achievements: int
+    due_review: int = None  # ordinal del repaso más atrasado del nivel actual
+
+class BotContext(CallbackContext):
+    """CallbackContext con el perfil del usuario y las consultas hechas en este update"""
+
+    def __init__(self, application, chat_id=None, user_id=None):
+        super().__init__(application, chat_id=chat_id, user_id=user_id)
+        self.profile = None
+        self.db_calls = 0
+
+# Registra al usuario si no existe y devuelve su fila. El INSERT y el SELECT usan la misma
+# instantánea: si otro worker inserta al mismo usuario a la vez, ninguna rama devuelve la
+# fila y load_profile repite la consulta
+LOAD_PROFILE = register_query("load_profile", """
+    WITH inserted AS (
+        INSERT INTO users (user_id, username) VALUES (%(user_id)s::bigint, %(username)s::varchar)
+        ON CONFLICT (user_id) DO NOTHING
+        RETURNING user_id, username, level, exercises, referrals, challenge_score,
+                  streak_days, last_practice, completed_bitmap, exercise_cursor, curiosity_offset,
+                  TRUE AS is_new
+    ),
+    reminder AS (
+        -- Recordatorio por defecto de los usuarios nuevos: 09:00 UTC
+        INSERT INTO user_reminders (user_id, reminder_time, timezone, utc_minute)
+        SELECT user_id, '09:00', 'UTC', 540 FROM inserted
+        ON CONFLICT (user_id) DO NOTHING
+    ),
+    profile AS (
+        SELECT * FROM inserted
+        UNION ALL
+        SELECT user_id, username, level, exercises, referrals, challenge_score,
+               streak_days, last_practice, completed_bitmap, exercise_cursor, curiosity_offset,
+               FALSE
+        FROM users WHERE user_id = %(user_id)s
+    )
+    SELECT p.*,
+           COALESCE(p.last_practice = CURRENT_DATE, FALSE),
+           (SELECT COUNT(*) FROM user_achievements ua WHERE ua.user_id = p.user_id),
+           (SELECT r.ordinal FROM review_items r
+            WHERE r.user_id = p.user_id AND r.level = lower(COALESCE(p.level, 'principiante'))
+              AND r.due_at <= now()
+            ORDER BY r.due_at LIMIT 1)
+    FROM profile p
+""")
+
+# Totales para /dbstats
+UPDATE_DB_STATS = {"updates": 0, "calls": 0}
+
+async def load_profile(user_id: int, username: str) -> UserProfile:
+    params = {"user_id": user_id, "username": username}
+    row = await db_fetchone(LOAD_PROFILE, params)
+    if row is None:
+        # Alta simultánea en otro worker: la nueva instantánea ya ve su fila
+        row = await db_fetchone(LOAD_PROFILE, params)
+    if row is None:
+        raise LookupError(f"No se pudo cargar el perfil del usuario {user_id}")
+    (user_id, username, level, exercises, referrals, challenge_score, streak_days,
+     last_practice, completed, exercise_cursor, curiosity_offset, is_new, practiced_today, achievements,
+     due_review) = row
+    # Sumar los incrementos que aún no se han escrito en la base de datos
+    pending = counter_buffer.pending(user_id)
+    return UserProfile(
+        user_id=user_id,
+        username=username,
+        level=(level or "principiante").lower(),
+        exercises=exercises + pending["exercises"],
+        referrals=referrals + pending["referrals"],
+        challenge_score=challenge_score + pending["challenge_score"],
+        streak_days=streak_days,
+        last_practice=last_practice,
+        completed_bitmap=bytes(completed) if completed else b"",
+        exercise_cursor=exercise_cursor + pending["exercise_cursor"],
+        curiosity_offset=curiosity_offset + pending["curiosity_offset"],
+        is_new=is_new,
+        practiced_today=practiced_today,
+        achievements=achievements,
+        due_review=due_review
+    )
+
+async def load_user_context(update: Update, context: BotContext):
+    """Etapa previa (grupo -1): bloqueo, registro y perfil del usuario con una sola consulta"""
+    current_update_context.set(context)
+    user = update.effective_user
+    if not user:
+        return
+
+    if check_user_blocked(user.id):
+        # Solo se responde a comandos y botones; el texto libre se ignora
+        if update.callback_query:
+            await update.callback_query.answer("⛔ Tu acceso está bloqueado.")
+        elif update.message and update.message.text and update.message.text.startswith("/"):
+            await update.message.reply_text("⛔ Tu acceso a este bot ha sido bloqueado.")
+        raise ApplicationHandlerStop
+
+    try:
+        context.profile = await load_profile(user.id, user.username)
+    except Exception as e:
+        logger.error(f"Error al cargar perfil: {e}")
+        raise ApplicationHandlerStop
+
+async def log_update_db_calls(update: Update, context: BotContext):
+    """Etapa final: registra cuántas consultas hizo el update"""
+    current_update_context.set(None)
+    UPDATE_DB_STATS["updates"] += 1
+    UPDATE_DB_STATS["calls"] += context.db_calls
+    logger.debug(f"Update {update.update_id}: {context.db_calls} consultas a la DB")
+
 # ========================================
 # HANDLERS PRINCIPALES (COMPLETOS)
 # ========================================
@@ -286,24 +2087,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
 
-    # Verificar si el usuario está bloqueado
-    if await check_user_blocked(user_id):
-        await update.message.reply_text("⛔ Tu acceso a este bot ha sido bloqueado.")
-        return
-
-    # Registrar usuario
-    await register_user(user_id, user.username)
-
-    # Manejar referidos
+    # Manejar referidos (solo cuenta la primera vez que el usuario llega al bot)
     ref_bonus = False
-    if context.args and context.args[0].startswith("ref_"):
+    if context.args and context.args[0].startswith("ref_") and context.profile.is_new:
         try:
             referrer_id = int(context.args[0].split("_")[1])
-            with db_cursor() as cursor:
-                cursor.execute(
-                    "UPDATE users SET referrals = referrals + 1 WHERE user_id = %s",
-                    (referrer_id,)
-                )
+            if referrer_id == user_id:
+                raise ValueError("autorreferencia")
+            counter_buffer.add(referrer_id, "referrals")
             # Otorgar logro por referir
             await grant_achievement(referrer_id, "Embajador")
             ref_bonus = True
@@ -347,99 +2138,192 @@ async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
     /premium - Información sobre contenido exclusivo
     /opinion - Enviar sugerencias o reportar errores
     /logros - Ver tus logros obtenidos
+    /recordatorio - Hora y zona horaria de tu recordatorio diario
     """
     await update.message.reply_text(help_text)
 
 async def ejercicio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     reply_func = get_reply_func(update)
-
-    # Verificar usuario bloqueado
-    if await check_user_blocked(user_id):
-        await reply_func("⛔ Tu acceso está bloqueado.")
-        return
+    profile = context.profile
 
     try:
-        # Actualizar racha de práctica
-        streak = await update_streak(user_id)
-
-        with db_cursor() as cursor:
-            # Obtener nivel y ejercicios completados
-            cursor.execute(
-                "SELECT level, completed_exercises FROM users WHERE user_id = %s",
-                (user_id,)
-            )
-            result = cursor.fetchone()
-            nivel = result[0].lower() if result else 'principiante'
-            completed_exercises = result[1].split(",") if result and result[1] else []
-
-            # Obtener todos los ejercicios disponibles para el nivel
-            all_exercises = []
-            for categoria, ejercicios in EJERCICIOS[nivel].items():
-                for idx, ejercicio in enumerate(ejercicios):
-                    exercise_id = f"{categoria}_{idx}"
-                    all_exercises.append((categoria, idx, ejercicio, exercise_id))
-
-            # Filtrar ejercicios no completados
-            available_exercises = [ex for ex in all_exercises if ex[3] not in completed_exercises]
-
-            # Si no hay ejercicios disponibles, reiniciar el progreso
-            if not available_exercises:
-                await reply_func("🎉 ¡Has completado todos los ejercicios! Reiniciando progreso...")
-                cursor.execute(
-                    "UPDATE users SET completed_exercises = '' WHERE user_id = %s",
-                    (user_id,)
+        # La racha solo cambia con la primera práctica del día
+        if profile.practiced_today:
+            streak, nivel, completed = profile.streak_days, profile.level, profile.completed_bitmap
+        else:
+            streak, nivel, completed = await start_practice(user_id)
+            profile.practiced_today = True
+
+        # Primero los repasos pendientes; si no hay, el siguiente ejercicio nuevo
+        ejercicio = level_done = None
+        if profile.due_review is not None:
+            ejercicio = CATALOG.get(nivel, profile.due_review)
+            if ejercicio is None:
+                # Ejercicio retirado del contenido: no debe tapar a los demás repasos
+                await db_execute(
+                    "DELETE FROM review_items WHERE user_id = %s AND level = %s AND ordinal = %s",
+                    (user_id, nivel, profile.due_review)
                 )
-                available_exercises = all_exercises
-
-            # Seleccionar un ejercicio aleatorio
-            categoria, idx, ejercicio, exercise_id = random.choice(available_exercises)
-
-            # Sanitizar y formatear mensaje
-            categoria_safe = sanitize_text(categoria)
-            nivel_safe = sanitize_text(nivel)
-            pregunta_safe = sanitize_text(ejercicio["pregunta"])
-
-            mensaje = (
-                f"📚 *Ejercicio de {categoria_safe} ({nivel_safe})*\n"
-                f"🔥 Racha actual: {streak} días\n\n"
-                f"{pregunta_safe}\n\n"
+        is_review = ejercicio is not None
+        if not is_review:
+            # Permutación del usuario; el cursor se guarda en diferido
+            ejercicio, cursor, level_done = next_unseen_exercise(
+                user_id, nivel, profile.exercise_cursor, completed
             )
+            counter_buffer.add(user_id, "exercise_cursor", cursor - profile.exercise_cursor)
+            profile.exercise_cursor = cursor
+
+        # Con todos los ejercicios del nivel completados se reinicia el progreso
+        if level_done:
+            await reply_func("🎉 ¡Has completado todos los ejercicios! Reiniciando progreso...")
+            await db_execute(
+                "UPDATE users SET completed_bitmap = '' WHERE user_id = %s",
+                (user_id,)
+            )
+            profile.completed_bitmap = b""
 
-            for opt_idx, opcion in enumerate(ejercicio["opciones"]):
-                opcion_safe = sanitize_text(opcion)
-                mensaje += f"{opt_idx + 1}. {opcion_safe}\n"
+        # El texto ya viene escapado del catálogo
+        repaso = "🔁 Repaso programado\n" if is_review else ""
+        mensaje = f"{ejercicio.header}{repaso}🔥 Racha actual: {streak} días\n\n{ejercicio.body}"
 
-            # Guardar en contexto
-            context.user_data["current_exercise"] = {
-                "id": exercise_id,
-                "correct": ejercicio["respuesta"],
-                "options": ejercicio["opciones"]
-            }
+        # Guardar en contexto
+        context.user_data["current_exercise"] = {
+            "id": ejercicio.key,
+            "ordinal": ejercicio.ordinal,
+            "level": nivel,
+            "correct": ejercicio.answer,
+            "options": ejercicio.options,
+            "matcher": ejercicio.matcher,
+            # Respuesta, opciones y ordinal (nunca se reutiliza) siguen valiendo aunque se
+            # recargue el contenido
+            "issued_at": datetime.now(timezone.utc),
+            "is_review": is_review
+        }
 
-            await reply_func(mensaje, parse_mode="Markdown")
+        await reply_func(mensaje, parse_mode="Markdown")
 
     except Exception as e:
         logger.error(f"Error en ejercicio: {e}")
         await reply_func("⚠️ Error al cargar ejercicio. Intenta nuevamente.")
 
+# Logros por número de ejercicios correctos: total -> (nombre, mensaje)
+EXERCISE_MILESTONES = {
+    10: ("Aprendiz", "🎉 ¡Logro desbloqueado: Aprendiz!"),
+    50: ("Experto", "🏆 ¡Logro desbloqueado: Experto!"),
+}
+
+# El total puede quedarse corto si un volcado de counter_buffer termina entre la lectura
+# del perfil y pending(): no se exige el número exacto, el hito alcanzado se envía en
+# cada acierto y el INSERT del logro es idempotente
+def exercise_milestone(total: int):
+    """Hito más alto alcanzado con total ejercicios, o None"""
+    reached = [threshold for threshold in EXERCISE_MILESTONES if threshold <= total]
+    return EXERCISE_MILESTONES[max(reached)] if reached else None
+
+# Marca el ejercicio y otorga el logro del hito (si lo hay) en un único viaje;
+# el punto se suma aparte en counter_buffer
+RECORD_CORRECT_ANSWER = """
+    WITH {marked_cte}granted AS (
+        INSERT INTO user_achievements (user_id, achievement_id)
+        SELECT %(user_id)s::bigint, %(achievement_id)s::int
+        WHERE %(achievement_id)s::int IS NOT NULL
+        ON CONFLICT DO NOTHING
+        RETURNING achievement_id
+    )
+    SELECT EXISTS (SELECT 1 FROM granted)
+"""
+
+MARKED_CTE = f"""marked AS (
+        UPDATE users SET completed_bitmap = {SET_COMPLETED_BIT}
+        WHERE user_id = %(user_id)s
+    ),
+    """
+
+RECORD_ANSWER_MARKED = register_query(
+    "record_answer_marked", RECORD_CORRECT_ANSWER.format(marked_cte=MARKED_CTE)
+)
+RECORD_ANSWER_GRANT = register_query(
+    "record_answer_grant", RECORD_CORRECT_ANSWER.format(marked_cte="")
+)
+
+# Repaso espaciado SM-2: calidad 0-5 de la respuesta -> repeticiones, intervalo y facilidad
+GRADE_REVIEW = register_query("grade_review", """
+    WITH prev AS (
+        -- Estado actual, o el inicial si el ejercicio aún no está programado
+        SELECT COALESCE(r.repetitions, 0) AS reps,
+               COALESCE(r.interval_days, 0) AS ivl,
+               COALESCE(r.ease, 2.5) AS ease
+        FROM (SELECT 1) AS one
+        LEFT JOIN review_items r
+            ON r.user_id = %(user_id)s::bigint AND r.level = %(level)s::varchar
+           AND r.ordinal = %(ordinal)s::int
+    ),
+    next AS (
+        SELECT
+            CASE WHEN %(quality)s::int >= 3 THEN reps + 1 ELSE 0 END AS reps,
+            CASE
+                WHEN %(quality)s::int < 3 OR reps = 0 THEN 1
+                WHEN reps = 1 THEN 6
+                ELSE GREATEST(1, round(ivl * ease))::int
+            END AS ivl,
+            GREATEST(1.3, ease + 0.1 - (5 - %(quality)s::int) * (0.08 + (5 - %(quality)s::int) * 0.02)) AS ease
+        FROM prev
+    )
+    INSERT INTO review_items (user_id, level, ordinal, repetitions, interval_days, ease, due_at)
+    SELECT %(user_id)s::bigint, %(level)s::varchar, %(ordinal)s::int, reps, ivl, ease,
+           now() + ivl * INTERVAL '1 day'
+    FROM next
+    ON CONFLICT (user_id, level, ordinal) DO UPDATE SET
+        repetitions = EXCLUDED.repetitions,
+        interval_days = EXCLUDED.interval_days,
+        ease = EXCLUDED.ease,
+        due_at = EXCLUDED.due_at
+""")
+
+# Respuesta correcta más rápida que esto (segundos) = calidad 5; si no, 4. Fallo = 1
+REVIEW_FAST_ANSWER = 10
+
+def review_quality(correct: bool, issued_at: datetime = None) -> int:
+    if not correct:
+        return 1
+    if issued_at and (datetime.now(timezone.utc) - issued_at).total_seconds() < REVIEW_FAST_ANSWER:
+        return 5
+    return 4
+
+def grade_review_tx(cursor, user_id: int, level: str, ordinal: int, quality: int):
+    execute_query(cursor, GRADE_REVIEW, {
+        "user_id": user_id, "level": level, "ordinal": ordinal, "quality": quality
+    })
+
+def record_correct_answer_tx(cursor, user_id: int, ordinal, achievement_id, review=None):
+    params = {"user_id": user_id, "achievement_id": achievement_id}
+    # Registrar ejercicio completado (los retos no tienen ordinal)
+    query = RECORD_ANSWER_MARKED if ordinal is not None else RECORD_ANSWER_GRANT
+    if ordinal is not None:
+        params.update(completed_bit_params(ordinal))
+
+    execute_query(cursor, query, params)
+    # True si se acaba de obtener el logro del hito
+    nuevo_logro = cursor.fetchone()[0]
+
+    # Calificación SM-2 en la misma transacción: (nivel, calidad)
+    if review is not None:
+        grade_review_tx(cursor, user_id, review[0], ordinal, review[1])
+    return nuevo_logro
+
 async def check_respuesta(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     user_data = context.user_data
 
-    # Verificar usuario bloqueado
-    if await check_user_blocked(user_id):
-        return
-
     # Validar que hay un ejercicio activo
     if "current_exercise" not in user_data:
         await update.message.reply_text("❌ No hay ejercicio activo. Usa /ejercicio.")
         return
 
-    # Validar entrada del usuario
-    try:
-        respuesta_usuario = validate_input(update.message.text.strip())
-    except ValueError:
+    # Validar entrada del usuario (sin escapar: se compara con el texto de las opciones)
+    respuesta_usuario = update.message.text.strip()
+    if len(respuesta_usuario) > 1000:
         await update.message.reply_text("❌ Entrada no válida. Por favor usa el número de opción.")
         return
 
@@ -447,52 +2331,57 @@ async def check_respuesta(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ejercicio_data = user_data["current_exercise"]
     correcta_idx = ejercicio_data["correct"]
     opciones = ejercicio_data["options"]
-    exercise_id = ejercicio_data["id"]
-
-    # Inicializar respuesta_idx con valor por defecto
-    respuesta_idx = -1
-
-    # Convertir respuesta a índice
-    try:
-        if respuesta_usuario.isdigit():
-            respuesta_idx = int(respuesta_usuario) - 1
-        else:
-            # Buscar coincidencia exacta (ignorando mayúsculas)
-            for idx, opcion_text in enumerate(opciones):
-                if respuesta_usuario.lower() == opcion_text.lower():
-                    respuesta_idx = idx
-                    break
-    except Exception as e:
-        logger.error(f"Error al convertir respuesta: {e}")
+    ordinal = ejercicio_data.get("ordinal")
+
+    # Convertir respuesta a índice: número de opción o texto (tolera tildes y erratas)
+    matcher = ejercicio_data.get("matcher") or OptionMatcher.build(opciones)
+    respuesta_idx = matcher.match(respuesta_usuario)
+
+    # Solo el primer intento de cada ejercicio cuenta para el repaso espaciado
+    review = None
+    if ordinal is not None and not ejercicio_data.get("graded"):
+        ejercicio_data["graded"] = True
+        review = ejercicio_data["level"]
+
+    # Registrar el intento: se escribe en lote con COPY, fuera de la ruta de respuesta
+    attempt_log.record(
+        user_id,
+        ejercicio_data["id"],
+        ejercicio_data.get("level"),
+        respuesta_idx if 0 <= respuesta_idx < len(opciones) else None,
+        respuesta_idx == correcta_idx,
+        ejercicio_data.get("issued_at")
+    )
+    if len(attempt_log) >= Config.ATTEMPT_FLUSH_SIZE:
+        schedule_attempt_flush(context.application)
 
     if respuesta_idx == correcta_idx:
         # Respuesta correcta
         try:
-            with db_cursor() as cursor:
-                # Actualizar progreso
-                cursor.execute(
-                    "UPDATE users SET exercises = exercises + 1 WHERE user_id = %s",
-                    (user_id,)
+            # El perfil ya incluye los incrementos pendientes
+            counter_buffer.add(user_id, "exercises")
+            context.profile.exercises += 1
+            nuevos_ejercicios = context.profile.exercises
+
+            milestone = exercise_milestone(nuevos_ejercicios)
+            achievement_id = ACHIEVEMENT_IDS[milestone[0]] if milestone else None
+            nuevo_logro = False
+            if ordinal is not None or achievement_id is not None:
+                nuevo_logro = await run_db(
+                    record_correct_answer_tx, user_id, ordinal, achievement_id,
+                    (review, review_quality(True, ejercicio_data.get("issued_at"))) if review else None
                 )
 
-                # Registrar ejercicio completado
-                cursor.execute(
-                    "SELECT completed_exercises FROM users WHERE user_id = %s",
-                    (user_id,)
-                )
-                completed = cursor.fetchone()[0] or ""
-                completed_list = completed.split(",") if completed else []
-
-                if exercise_id not in completed_list:
-                    completed_list.append(exercise_id)
-                    cursor.execute(
-                        "UPDATE users SET completed_exercises = %s WHERE user_id = %s",
-                        (",".join(completed_list), user_id)
-                    )
-
-                # Obtener nuevo total
-                cursor.execute("SELECT exercises FROM users WHERE user_id = %s", (user_id,))
-                nuevos_ejercicios = cursor.fetchone()[0]
+            # Punto de reto: una sola vez por reto y usuario
+            reto_msg = ""
+            challenge_id = ejercicio_data.get("challenge_id")
+            if challenge_id is not None:
+                if await run_db(complete_challenge_tx, challenge_id, user_id):
+                    counter_buffer.add(user_id, "challenge_score")
+                    context.profile.challenge_score += 1
+                    reto_msg = "\n🔥 +1 punto de reto"
+                else:
+                    reto_msg = "\n🔥 Ya sumaste el punto de este reto"
 
             # Mensaje de éxito
             keyboard = [
@@ -505,15 +2394,11 @@ async def check_respuesta(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # Verificar logros
             achievement_msg = ""
-            if nuevos_ejercicios == 10:
-                await grant_achievement(user_id, "Aprendiz")
-                achievement_msg = "\n\n🎉 ¡Logro desbloqueado: Aprendiz!"
-            elif nuevos_ejercicios == 50:
-                await grant_achievement(user_id, "Experto")
-                achievement_msg = "\n\n🏆 ¡Logro desbloqueado: Experto!"
+            if nuevo_logro:
+                achievement_msg = f"\n\n{milestone[1]}"
 
             await update.message.reply_text(
-                f"✅ ¡Correcto! +1 punto\n🏆 Total: {nuevos_ejercicios}{achievement_msg}",
+                f"✅ ¡Correcto! +1 punto{reto_msg}\n🏆 Total: {nuevos_ejercicios}{achievement_msg}",
                 reply_markup=InlineKeyboardMarkup(keyboard),
                 parse_mode="Markdown"
             )
@@ -528,7 +2413,13 @@ async def check_respuesta(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.error(f"Error en respuesta correcta: {e}")
             await update.message.reply_text("⚠️ Error al actualizar tu progreso")
     else:
-        # Respuesta incorrecta
+        # Respuesta incorrecta: el ejercicio vuelve a repasarse mañana
+        if review:
+            try:
+                await run_db(grade_review_tx, user_id, review, ordinal, review_quality(False))
+            except Exception as e:
+                logger.error(f"Error al programar repaso: {e}")
+
         correct_option = opciones[correcta_idx]
         await update.message.reply_text(
             f"✨ Casi lo logras. La respuesta correcta era: *{correct_option}*",
@@ -553,8 +2444,19 @@ async def check_respuesta(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
 async def show_curiosity(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Muestra una curiosidad aleatoria sobre el español"""
-    curiosidad = random.choice(CURIOSIDADES)
+    """Muestra la siguiente curiosidad del usuario sin repetir hasta ver todas"""
+    profile = context.profile
+    if profile is None:
+        curiosidad = random.choice(CURIOSIDADES)
+    else:
+        # Misma permutación que los ejercicios: el estado es solo un offset por usuario
+        n = len(CURIOSIDADES)
+        ronda, posicion = divmod(profile.curiosity_offset, n)
+        curiosidad = CURIOSIDADES[
+            permute_index(posicion, n, permutation_keys(profile.user_id, "curiosidades", ronda))
+        ]
+        counter_buffer.add(profile.user_id, "curiosity_offset")
+        profile.curiosity_offset += 1
     mensaje = (
         f"🧠 *Curiosidad del español ({curiosidad['categoria']}):*\n\n"
         f"{curiosidad['texto']}"
@@ -585,82 +2487,62 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass
 
 async def progreso(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
     reply_func = get_reply_func(update)
+    profile = context.profile
 
     try:
-        with db_cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT level, exercises, referrals, challenge_score, streak_days
-                FROM users WHERE user_id = %s
-                """,
-                (user_id,)
-            )
-            data = cursor.fetchone()
-
-            if not data:
-                await reply_func("❌ No se encontraron datos de progreso.")
-                return
-
-            nivel, ejercicios, referidos, puntos_reto, racha = data
+        if not profile:
+            await reply_func("❌ No se encontraron datos de progreso.")
+            return
 
-            # Calcular porcentaje de completitud
-            cursor.execute(
-                "SELECT COUNT(*) FROM user_achievements WHERE user_id = %s",
-                (user_id,)
-            )
-            logros = cursor.fetchone()[0]
-
-            # Generar barra de progreso
-            nivel_base = 50 if nivel == "principiante" else 100 if nivel == "intermedio" else 150
-            porcentaje = min(100, int((ejercicios / nivel_base) * 100))
-            progress_bar = generate_progress_bar(porcentaje)
-
-            progreso_text = (
-                f"📈 **Tu Progreso**\n\n"
-                f"📊 Nivel: {nivel.capitalize()}\n"
-                f"✅ Ejercicios completados: {ejercicios}\n"
-                f"🔥 Racha actual: {racha} días\n"
-                f"👥 Amigos invitados: {referidos}\n"
-                f"🏆 Puntos en retos: {puntos_reto}\n"
-                f"🎖️ Logros obtenidos: {logros}\n\n"
-                f"📊 Progreso del nivel:\n{progress_bar}"
-            )
+        # Todo sale del perfil cargado al inicio del update: sin consultas extra
+        nivel, ejercicios, referidos = profile.level, profile.exercises, profile.referrals
+        puntos_reto, racha, logros = profile.challenge_score, profile.streak_days, profile.achievements
+
+        # Generar barra de progreso
+        nivel_base = 50 if nivel == "principiante" else 100 if nivel == "intermedio" else 150
+        porcentaje = min(100, int((ejercicios / nivel_base) * 100))
+        progress_bar = generate_progress_bar(porcentaje)
+
+        progreso_text = (
+            f"📈 **Tu Progreso**\n\n"
+            f"📊 Nivel: {nivel.capitalize()}\n"
+            f"✅ Ejercicios completados: {ejercicios}\n"
+            f"🔥 Racha actual: {racha} días\n"
+            f"👥 Amigos invitados: {referidos}\n"
+            f"🏆 Puntos en retos: {puntos_reto}\n"
+            f"🎖️ Logros obtenidos: {logros}\n\n"
+            f"📊 Progreso del nivel:\n{progress_bar}"
+        )
 
-            await reply_func(progreso_text)
+        await reply_func(progreso_text)
 
     except Exception as e:
         logger.error(f"Error en progreso: {e}")
         await reply_func("⚠️ Error al obtener tu progreso")
 
+USER_ACHIEVEMENT_IDS = register_query("user_achievement_ids", """
+    SELECT achievement_id FROM user_achievements WHERE user_id = %(user_id)s ORDER BY earned_at
+""", read_only=True)
+
 async def logros(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra los logros obtenidos por el usuario"""
     user_id = update.effective_user.id
     reply_func = get_reply_func(update)
 
     try:
-        with db_cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT a.name, a.description, a.icon
-                FROM user_achievements ua
-                JOIN achievements a ON ua.achievement_id = a.achievement_id
-                WHERE ua.user_id = %s
-                """,
-                (user_id,)
-            )
-            logros = cursor.fetchall()
+        logros = await db_fetchall(USER_ACHIEVEMENT_IDS, {"user_id": user_id})
+        logros = [ACHIEVEMENT_CATALOG[row[0]] for row in logros if row[0] in ACHIEVEMENT_CATALOG]
 
-            if not logros:
-                await reply_func("🎯 Aún no has obtenido logros. ¡Sigue practicando!")
-                return
+        if not logros:
+            await reply_func("🎯 Aún no has obtenido logros. ¡Sigue practicando!")
+            return
 
-            logros_text = "🏆 **Logros Obtenidos:**\n\n"
-            for nombre, descripcion, icono in logros:
-                logros_text += f"{icono} *{nombre}*\n{descripcion}\n\n"
+        logros_text = "🏆 **Logros Obtenidos:**\n\n"
+        for nombre, descripcion, icono in logros:
+            logros_text += f"{icono} *{nombre}*\n{descripcion}\n\n"
 
-            await reply_func(logros_text, parse_mode="Markdown")
+        await reply_func(logros_text, parse_mode="Markdown")
 
     except Exception as e:
         logger.error(f"Error en logros: {e}")
@@ -697,11 +2579,15 @@ async def set_level(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        with db_cursor() as cursor:
-            cursor.execute(
-                "UPDATE users SET level = %s, completed_exercises = '' WHERE user_id = %s",
-                (new_level, user_id)
-            )
+        await db_execute(
+            "UPDATE users SET level = %s, completed_bitmap = '' WHERE user_id = %s",
+            (new_level, user_id)
+        )
+        # Empezar una ronda nueva en el nivel elegido
+        profile = context.profile
+        cursor = round_start_cursor(profile.exercise_cursor, new_level)
+        counter_buffer.add(user_id, "exercise_cursor", cursor - profile.exercise_cursor)
+        profile.exercise_cursor = cursor
 
         # Teclado principal para continuar
         keyboard = [
@@ -750,45 +2636,108 @@ async def invitar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"Error en invitar: {e}")
         await update.message.reply_text("⚠️ Error al generar enlace de invitación")
 
-async def reto(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        user_id = update.effective_user.id
-        reply_func = get_reply_func(update)
-
-        # Verificar usuario bloqueado
-        if await check_user_blocked(user_id):
-            await reply_func("⛔ Tu acceso está bloqueado.")
-            return
-
-        # Usar nivel avanzado para retos
-        nivel_reto = "avanzado"
-        categoria = random.choice(list(EJERCICIOS[nivel_reto].keys()))
-        ejercicio = random.choice(EJERCICIOS[nivel_reto][categoria])
-
-        # Sanitizar y formatear
-        categoria_safe = sanitize_text(categoria)
-        pregunta_safe = sanitize_text(ejercicio["pregunta"])
+# ========================================
+# RETO DIARIO
+# ========================================
 
-        mensaje = (
-            f"🔥 *Reto Diario - {categoria_safe} ({nivel_reto.capitalize()})*\n\n"
-            f"{pregunta_safe}\n\n"
+# Nivel de los retos
+CHALLENGE_LEVEL = "avanzado"
+
+@dataclass(frozen=True)
+class DailyChallenge:
+    """Reto del día (UTC) con su mensaje ya renderizado"""
+    challenge_id: int
+    day: date
+    exercise: Exercise
+    message: str
+
+# Se calcula una vez por día y worker; se invalida al recargar el contenido
+daily_challenge = None
+daily_challenge_lock = asyncio.Lock()
+
+def pick_challenge_exercise(day: date) -> Exercise:
+    """Elección determinista a partir de la fecha: todos los workers proponen el mismo"""
+    grupos = CATALOG.categories[CHALLENGE_LEVEL]
+    seed = int.from_bytes(hashlib.blake2b(day.isoformat().encode(), digest_size=8).digest(), "little")
+    grupo = grupos[seed % len(grupos)]
+    return grupo[(seed // len(grupos)) % len(grupo)]
+
+def ensure_challenge_tx(cursor, day: date, exercise: Exercise):
+    # El primero que lo inserta decide; el resto lee la misma fila
+    cursor.execute(
+        """
+        INSERT INTO challenges
+            (challenge_date, level, ordinal, exercise_key, description, start_date, end_date)
+        VALUES (%s, %s, %s, %s, %s, %s, %s + 1)
+        ON CONFLICT (challenge_date) DO NOTHING
+        """,
+        (day, exercise.level, exercise.ordinal, exercise.key,
+         f"Reto diario: {exercise.category}", day, day)
+    )
+    cursor.execute(
+        "SELECT challenge_id, level, ordinal FROM challenges WHERE challenge_date = %s",
+        (day,)
+    )
+    return cursor.fetchone()
+
+async def get_daily_challenge() -> DailyChallenge:
+    """Devuelve el reto de hoy, creándolo en challenges la primera vez"""
+    global daily_challenge
+    today = datetime.now(timezone.utc).date()
+    challenge = daily_challenge
+    if challenge is not None and challenge.day == today:
+        return challenge
+
+    async with daily_challenge_lock:
+        if daily_challenge is not None and daily_challenge.day == today:
+            return daily_challenge
+        challenge_id, level, ordinal = await run_db(
+            ensure_challenge_tx, today, pick_challenge_exercise(today)
+        )
+        exercise = CATALOG.get(level, ordinal)
+        if exercise is None:
+            raise LookupError(f"El ejercicio del reto {challenge_id} ya no existe")
+        daily_challenge = DailyChallenge(
+            challenge_id=challenge_id,
+            day=today,
+            exercise=exercise,
+            message=(
+                f"{exercise.challenge_header}{exercise.body}"
+                "\n🏆 ¡Responde correctamente para ganar puntos extra!"
+            )
         )
+        return daily_challenge
 
-        for idx, opcion in enumerate(ejercicio["opciones"]):
-            opcion_safe = sanitize_text(opcion)
-            mensaje += f"{idx + 1}. {opcion_safe}\n"
+COMPLETE_CHALLENGE = register_query("complete_challenge", """
+    INSERT INTO challenge_completions (challenge_id, user_id)
+    VALUES (%(challenge_id)s::int, %(user_id)s::bigint)
+    ON CONFLICT DO NOTHING
+""")
 
-        mensaje += "\n🏆 ¡Responde correctamente para ganar puntos extra!"
+def complete_challenge_tx(cursor, challenge_id: int, user_id: int) -> bool:
+    """True solo la primera vez que el usuario acierta este reto"""
+    execute_query(cursor, COMPLETE_CHALLENGE, {"challenge_id": challenge_id, "user_id": user_id})
+    return cursor.rowcount == 1
+
+async def reto(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        reply_func = get_reply_func(update)
+        challenge = await get_daily_challenge()
+        ejercicio = challenge.exercise
 
         # Guardar en contexto como reto
         context.user_data["current_exercise"] = {
-            "id": f"reto_{uuid.uuid4().hex[:6]}",
-            "correct": ejercicio["respuesta"],
-            "options": ejercicio["opciones"],
+            "id": f"reto_{challenge.challenge_id}",
+            "challenge_id": challenge.challenge_id,
+            "level": CHALLENGE_LEVEL,
+            "correct": ejercicio.answer,
+            "options": ejercicio.options,
+            "matcher": ejercicio.matcher,
+            "issued_at": datetime.now(timezone.utc),
             "is_challenge": True  # Marcar como reto especial
         }
 
-        await reply_func(mensaje, parse_mode="Markdown")
+        await reply_func(challenge.message, parse_mode="Markdown")
 
     except Exception as e:
         logger.error(f"Error en reto: {e}")
@@ -820,11 +2769,10 @@ async def recibir_opinion(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         feedback_text = validate_input(update.message.text, max_length=1000)
 
-        with db_cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO feedback (user_id, message) VALUES (%s, %s)",
-                (user_id, feedback_text)
-            )
+        await db_execute(
+            "INSERT INTO feedback (user_id, message) VALUES (%s, %s)",
+            (user_id, feedback_text)
+        )
 
         # Mensaje de agradecimiento
         await update.message.reply_text(
@@ -855,6 +2803,46 @@ async def recibir_opinion(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return ConversationHandler.END
 
+def format_pool_stats(stats: dict) -> str:
+    return (
+        f"conexiones {stats['in_use']}/{stats['max']} en uso, {stats['idle']} libres, "
+        f"{stats['waiting']} esperando | espera media {stats['wait_avg_ms']:.1f} ms "
+        f"(máx {stats['wait_max_ms']:.1f}) | uso medio {stats['checkout_avg_ms']:.1f} ms "
+        f"(máx {stats['checkout_max_ms']:.1f}) | {stats['checkouts']} checkouts, "
+        f"{stats['timeouts']} timeouts, {stats['recycled']} recicladas"
+    )
+
+async def dbstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra las métricas del pool de conexiones (solo administrador)"""
+    if not is_admin(update.effective_user.id):
+        return
+    updates = UPDATE_DB_STATS["updates"]
+    por_update = UPDATE_DB_STATS["calls"] / updates if updates else 0.0
+    mensaje = (
+        f"🗄️ Pool DB: {format_pool_stats(connection_pool.stats())}\n"
+        f"📨 {updates} updates, {por_update:.2f} consultas por update"
+    )
+    if replica_pool is not None:
+        lag = f"{replica_lag:.1f}s" if replica_lag is not None else "sin respuesta"
+        mensaje += f"\n📖 Réplica (retraso {lag}): {format_pool_stats(replica_pool.stats())}"
+    await update.message.reply_text(mensaje)
+
+async def recargar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Recarga ejercicios y curiosidades sin reiniciar (solo administrador)"""
+    if not is_admin(update.effective_user.id):
+        return
+    try:
+        version = await reload_content()
+    except Exception as e:
+        await update.message.reply_text(f"❌ Contenido rechazado: {e}")
+        return
+    niveles = ", ".join(f"{nivel}: {len(lista)}" for nivel, lista in CATALOG.levels.items())
+    await update.message.reply_text(f"✅ Contenido versión {version} ({niveles})")
+
+async def log_pool_stats(context: ContextTypes.DEFAULT_TYPE):
+    """Registra periódicamente las métricas del pool"""
+    logger.info(f"Pool DB: {format_pool_stats(connection_pool.stats())}")
+
 # ========================================
 # MANEJO DE BOTONES DEL TECLADO PRINCIPAL
 # ========================================
@@ -884,39 +2872,400 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # Si no es un botón reconocido, intentar verificar como respuesta
         await check_respuesta(update, context)
+
 # ========================================
-# FUNCIÓN PARA RECORDATORIOS DIARIOS (AÑADIR ANTES DE main())
+# ENVÍOS MASIVOS (BROADCAST)
 # ========================================
 
-async def enviar_recordatorio(context: ContextTypes.DEFAULT_TYPE):
-    """Envía recordatorios diarios a los usuarios"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+# Destinatarios por audiencia, paginados por user_id (keyset): cada página es una
+# consulta corta y el último user_id enviado basta como punto de control
+BROADCAST_AUDIENCES = {
+    "todos": "SELECT user_id FROM users WHERE user_id > %(after)s ORDER BY user_id LIMIT %(limit)s",
+    # param = minuto del día en UTC (idx_user_reminders_minute)
+    "recordatorio": """
+        SELECT user_id FROM user_reminders
+        WHERE utc_minute = %(param)s AND user_id > %(after)s
+        ORDER BY user_id LIMIT %(limit)s
+    """,
+}
+
+class RateLimiter:
+    """Reparte los envíos a ritmo constante y admite pausas globales (RetryAfter)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def wait(self):
+        # Sin await entre leer y reservar el turno: no hace falta lock en el event loop
+        now = monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        self._next = max(self._next, monotonic() + seconds)
+
+# Un único ritmo por worker para todos los envíos que estén en marcha a la vez
+broadcast_limiter = RateLimiter(Config.BROADCAST_RATE)
+
+def claim_broadcast_tx(cursor, name: str, audience: str, audience_param, message: str,
+                       owner: str, lease: int):
+    # Crear el envío la primera vez; después solo se reserva si nadie lo tiene
+    if message is not None:
+        cursor.execute(
+            """
+            INSERT INTO broadcasts (name, audience, audience_param, message) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (name) DO NOTHING
+            """,
+            (name, audience, audience_param, message)
+        )
+    cursor.execute(
+        """
+        UPDATE broadcasts SET owner = %s, locked_until = now() + make_interval(secs => %s)
+        WHERE name = %s AND finished_at IS NULL
+          AND (locked_until IS NULL OR locked_until < now())
+        RETURNING broadcast_id, audience, audience_param, message, last_user_id, sent, failed
+        """,
+        (owner, lease, name)
+    )
+    return cursor.fetchone()
+
+async def keep_broadcast_lease(broadcast_id: int, owner: str):
+    """Renueva la reserva mientras dure el envío; termina si otro worker se la ha quedado"""
+    while True:
+        await asyncio.sleep(Config.BROADCAST_LEASE / 3)
+        try:
+            renewed = await db_execute(
+                """
+                UPDATE broadcasts SET locked_until = now() + make_interval(secs => %s)
+                WHERE broadcast_id = %s AND owner = %s AND finished_at IS NULL
+                """,
+                (Config.BROADCAST_LEASE, broadcast_id, owner)
+            )
+        except Exception as e:
+            logger.error(f"Error al renovar la reserva del envío {broadcast_id}: {e}")
+            renewed = 0
+        if not renewed:
+            return
 
-        # Obtener todos los usuarios
-        cursor.execute("SELECT user_id FROM users")
-        for user in cursor.fetchall():
+async def deliver(bot, user_id: int, text: str, limiter: RateLimiter, slots: asyncio.Semaphore) -> bool:
+    """Envía un mensaje respetando el ritmo global; True si se entregó"""
+    if check_user_blocked(user_id):
+        return False
+    async with slots:
+        for _ in range(3):
+            await limiter.wait()
             try:
-                await context.bot.send_message(
-                    chat_id=user[0],
-                    text="⏰ ¡No olvides practicar hoy! Usa /ejercicio para tu práctica diaria.",
-                )
-            except Exception as e:
-                print(f"Error enviando recordatorio a {user[0]}: {e}")
+                await bot.send_message(chat_id=user_id, text=text)
+                return True
+            except RetryAfter as e:
+                # Límite de Telegram: todo el envío se detiene, no solo este mensaje
+                logger.warning(f"RetryAfter en envío masivo: pausa de {e.retry_after}s")
+                limiter.pause(e.retry_after)
+            except Forbidden:
+                return False  # El usuario bloqueó el bot
+            except TelegramError as e:
+                logger.warning(f"Error enviando a {user_id}: {e}")
+                return False
+    return False
 
-    except Exception as e:
-        print(f"Error en recordatorio: {e}")
+async def run_broadcast(bot, name: str, message: str = None, audience: str = "todos",
+                        audience_param: int = None):
+    """Envía (o reanuda) un broadcast; devuelve (enviados, fallidos) o None si no le toca"""
+    owner = secrets.token_hex(16)
+    claimed = await run_db(
+        claim_broadcast_tx, name, audience, audience_param, message, owner, Config.BROADCAST_LEASE
+    )
+    if not claimed:
+        return None
+    broadcast_id, audience, audience_param, message, last_user_id, sent, failed = claimed
+    if last_user_id:
+        logger.info(f"Reanudando envío {name} desde user_id {last_user_id} ({sent} enviados)")
+
+    # La reserva se renueva también con una página en vuelo (p. ej. tras varios RetryAfter)
+    lease = asyncio.create_task(keep_broadcast_lease(broadcast_id, owner))
+    try:
+        slots = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+        query = BROADCAST_AUDIENCES[audience]
+        while True:
+            rows = await db_fetchall(query, {
+                "after": last_user_id, "limit": Config.BROADCAST_PAGE_SIZE, "param": audience_param
+            })
+            if not rows:
+                break
+            page = asyncio.ensure_future(asyncio.gather(
+                *(deliver(bot, user_id, message, broadcast_limiter, slots) for (user_id,) in rows)
+            ))
+            await asyncio.wait({page, lease}, return_when=asyncio.FIRST_COMPLETED)
+            if not page.done():
+                page.cancel()
+                await asyncio.gather(page, return_exceptions=True)
+                logger.warning(f"Envío {name}: reserva perdida, se detiene en user_id {last_user_id}")
+                return None
+            results = page.result()
+            sent += sum(results)
+            failed += len(results) - sum(results)
+            last_user_id = rows[-1][0]
+
+            # Punto de control: tras una caída solo se repite, como mucho, la página en curso.
+            # Solo lo escribe quien tiene la reserva
+            saved = await db_execute(
+                """
+                UPDATE broadcasts
+                SET last_user_id = %s, sent = %s, failed = %s,
+                    locked_until = now() + make_interval(secs => %s)
+                WHERE broadcast_id = %s AND owner = %s
+                """,
+                (last_user_id, sent, failed, Config.BROADCAST_LEASE, broadcast_id, owner)
+            )
+            if not saved:
+                logger.warning(f"Envío {name}: reserva perdida, se detiene en user_id {last_user_id}")
+                return None
+
+        finished = await db_execute(
+            """
+            UPDATE broadcasts SET finished_at = now(), locked_until = NULL
+            WHERE broadcast_id = %s AND owner = %s
+            """,
+            (broadcast_id, owner)
+        )
+        if not finished:
+            logger.warning(f"Envío {name}: reserva perdida antes de cerrarlo")
+            return None
     finally:
-        cursor.close()
-        conn.close()
+        lease.cancel()
+
+    logger.info(f"Envío {name} terminado: {sent} enviados, {failed} fallidos")
+    return sent, failed
+
+async def resume_broadcasts(context: ContextTypes.DEFAULT_TYPE):
+    """Job periódico: retoma los envíos que otro worker dejó a medias"""
+    try:
+        pending = await db_fetchall(
+            """
+            SELECT name FROM broadcasts
+            WHERE finished_at IS NULL AND locked_until < now()
+              AND started_at > now() - INTERVAL '1 day'
+            """
+        )
+        for (name,) in pending:
+            await run_broadcast(context.bot, name)
+    except Exception as e:
+        logger.error(f"Error al reanudar envíos: {e}")
+
+# ========================================
+# RECORDATORIOS POR ZONA HORARIA
+# ========================================
+
+REMINDER_TEXT = "⏰ ¡No olvides practicar hoy! Usa /ejercicio para tu práctica diaria."
+# Minutos hacia atrás que un tick recupera si el job se retrasó o el worker arrancaba
+REMINDER_CATCH_UP = 5
+
+REMINDER_BUCKET_HAS_USERS = register_query("reminder_bucket_has_users", """
+    SELECT EXISTS (SELECT 1 FROM user_reminders WHERE utc_minute = %(minute)s::smallint)
+""")
+
+# Último tramo (minuto UTC) que este worker ya lanzó
+last_reminder_minute = None
+
+async def send_reminder_bucket(bot, tramo: datetime):
+    minute = tramo.hour * 60 + tramo.minute
+    try:
+        (has_users,) = await db_fetchone(REMINDER_BUCKET_HAS_USERS, {"minute": minute})
+        if has_users:
+            # Un broadcast por tramo: reanudable y sin duplicados entre workers
+            await run_broadcast(
+                bot, f"recordatorio:{tramo:%Y-%m-%d}:{minute:04d}", REMINDER_TEXT,
+                "recordatorio", minute
+            )
+    except Exception as e:
+        logger.error(f"Error en recordatorio de las {tramo:%H:%M} UTC: {e}")
+
+async def enviar_recordatorios(context: ContextTypes.DEFAULT_TYPE):
+    """Job de cada minuto: lanza el recordatorio de los usuarios de este minuto UTC"""
+    global last_reminder_minute
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    tramo = now - timedelta(minutes=REMINDER_CATCH_UP - 1)
+    if last_reminder_minute is not None:
+        tramo = max(tramo, last_reminder_minute + timedelta(minutes=1))
+
+    while tramo <= now:
+        # En segundo plano: un tramo grande no retrasa el tick siguiente
+        context.application.create_task(send_reminder_bucket(context.bot, tramo))
+        last_reminder_minute = tramo
+        tramo += timedelta(minutes=1)
+
+async def refresh_reminder_minutes(context: ContextTypes.DEFAULT_TYPE):
+    """Job diario: recalcula utc_minute (horario de verano) y limpia envíos antiguos"""
+    try:
+        changed = await db_execute(
+            f"""
+            UPDATE user_reminders SET utc_minute = {REMINDER_UTC_MINUTE}
+            WHERE reminder_time IS NOT NULL AND utc_minute IS DISTINCT FROM {REMINDER_UTC_MINUTE}
+            """
+        )
+        if changed:
+            logger.info(f"Recordatorios reubicados por cambio de hora: {changed}")
+        # resume_broadcasts no retoma los envíos de más de un día: quedan abandonados
+        abandoned = await db_execute(
+            """
+            DELETE FROM broadcasts
+            WHERE finished_at IS NULL AND started_at < now() - INTERVAL '1 day'
+              AND (locked_until IS NULL OR locked_until < now())
+            """
+        )
+        if abandoned:
+            logger.warning(f"Envíos abandonados eliminados: {abandoned}")
+        await db_execute("DELETE FROM broadcasts WHERE finished_at < now() - INTERVAL '7 days'")
+    except Exception as e:
+        logger.error(f"Error al recalcular recordatorios: {e}")
+
+async def recordatorio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/recordatorio HH:MM [Zona/Horaria] | off"""
+    user_id = update.effective_user.id
+    args = context.args or []
+    try:
+        if not args:
+            row = await db_fetchone(
+                "SELECT reminder_time, timezone FROM user_reminders WHERE user_id = %s",
+                (user_id,)
+            )
+            actual = (
+                f"{row[0]:%H:%M} ({row[1]})" if row and row[0] else "desactivado"
+            )
+            await update.message.reply_text(
+                f"⏰ Tu recordatorio: {actual}\n"
+                "Cámbialo con /recordatorio 20:30 Europe/Madrid o desactívalo con /recordatorio off"
+            )
+            return
+
+        if args[0].lower() == "off":
+            await db_execute(
+                "UPDATE user_reminders SET reminder_time = NULL, utc_minute = NULL WHERE user_id = %s",
+                (user_id,)
+            )
+            await update.message.reply_text("🔕 Recordatorio desactivado")
+            return
+
+        try:
+            hora = datetime.strptime(args[0], "%H:%M").time()
+        except ValueError:
+            await update.message.reply_text("❌ Hora no válida. Usa el formato HH:MM, p. ej. 20:30")
+            return
+        zona = args[1] if len(args) > 1 else "UTC"
+        if zona not in pytz.all_timezones_set:
+            await update.message.reply_text("❌ Zona horaria no válida. Ejemplo: America/Mexico_City")
+            return
+
+        await db_execute(
+            f"""
+            INSERT INTO user_reminders AS r (user_id, reminder_time, timezone)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE
+                SET reminder_time = EXCLUDED.reminder_time, timezone = EXCLUDED.timezone;
+            UPDATE user_reminders SET utc_minute = {REMINDER_UTC_MINUTE} WHERE user_id = %s
+            """,
+            (user_id, hora, zona, user_id)
+        )
+        await update.message.reply_text(f"⏰ Te recordaré practicar cada día a las {hora:%H:%M} ({zona})")
+    except Exception as e:
+        logger.error(f"Error en recordatorio: {e}")
+        await update.message.reply_text("⚠️ Error al configurar el recordatorio")
 
 # ========================================
 # CONFIGURACIÓN PRINCIPAL
 # ========================================
 
+class UserLocks:
+    """Un asyncio.Lock por usuario, creado al primer update y borrado al quedar libre"""
+
+    def __init__(self):
+        self._locks = {}  # clave -> [lock, updates que lo usan o esperan]
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock atiende a los que esperan en orden de llegada
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+user_locks = UserLocks()
+update_slots = asyncio.Semaphore(Config.CONCURRENT_UPDATES)
+
+class BotApplication(Application):
+    """Application con updates concurrentes y orden garantizado por usuario"""
+
+    async def process_update(self, update: object) -> None:
+        user = getattr(update, "effective_user", None)
+        chat = getattr(update, "effective_chat", None)
+        key = user.id if user else (chat.id if chat else None)
+        if key is None:
+            async with update_slots:
+                await super().process_update(update)
+            return
+
+        # Primero el turno del usuario y después el hueco: un usuario con muchos
+        # updates en cola no ocupa huecos que podrían usar otros usuarios
+        async with user_locks.hold(key):
+            async with update_slots:
+                await super().process_update(update)
+
+def webhook_settings() -> dict:
+    """Parámetros de run_webhook según Config (requiere python-telegram-bot[webhooks])"""
+    if not Config.WEBHOOK_URL or not Config.WEBHOOK_SECRET:
+        raise SystemExit("BOT_MODE=webhook necesita WEBHOOK_URL y WEBHOOK_SECRET")
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", Config.WEBHOOK_SECRET):
+        raise SystemExit("WEBHOOK_SECRET solo admite 1-256 caracteres A-Z, a-z, 0-9, _ y -")
+    return {
+        "listen": Config.WEBHOOK_LISTEN,
+        "port": Config.WEBHOOK_PORT,
+        "url_path": Config.WEBHOOK_PATH,
+        "webhook_url": f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH}",
+        "secret_token": Config.WEBHOOK_SECRET,
+        "max_connections": Config.WEBHOOK_MAX_CONNECTIONS,
+        "allowed_updates": Update.ALL_TYPES,
+    }
+
 def main():
-    application = Application.builder().token(Config.TOKEN).build()
+    if Config.BOT_MODE not in ("polling", "webhook"):
+        raise SystemExit(f"BOT_MODE desconocido: {Config.BOT_MODE} (polling o webhook)")
+    webhook = webhook_settings() if Config.BOT_MODE == "webhook" else None
+
+    # Inicializar el pool de conexiones y comprobar el esquema
+    init_db_pool()
+    ensure_schema()
+    load_achievement_catalog()
+    load_exercise_index()
+    start_blocked_users_listener()
+    check_replica_lag()
+
+    application = (
+        Application.builder()
+        .application_class(BotApplication)
+        .token(Config.TOKEN)
+        .context_types(ContextTypes(context=BotContext))
+        # El límite real de paralelismo lo pone update_slots; esto acota los updates en vuelo
+        .concurrent_updates(Config.MAX_PENDING_UPDATES)
+        .build()
+    )
+
+    # Etapa previa: perfil del usuario y bloqueo, antes que cualquier otro handler
+    application.add_handler(TypeHandler(Update, load_user_context), group=-1)
+    # Etapa final: contador de consultas por update
+    application.add_handler(TypeHandler(Update, log_update_db_calls), group=1)
 
     # Handlers principales
     application.add_handler(CommandHandler("start", start))
@@ -928,6 +3277,9 @@ def main():
     application.add_handler(CommandHandler("reto", reto))
     application.add_handler(CommandHandler("premium", premium))
     application.add_handler(CommandHandler("nivel", nivel))
+    application.add_handler(CommandHandler("recordatorio", recordatorio))
+    application.add_handler(CommandHandler("dbstats", dbstats))
+    application.add_handler(CommandHandler("recargar", recargar))
 
     # Handler para botones inline
     application.add_handler(CallbackQueryHandler(button_handler))
@@ -954,15 +3306,113 @@ def main():
         set_level
     ))
 
-    # Programar recordatorios diarios
+    # Recordatorios: un tick por minuto, alineado al inicio de cada minuto
+    application.job_queue.run_repeating(
+        enviar_recordatorios,
+        interval=60,
+        first=60 - datetime.now(timezone.utc).second
+    )
     application.job_queue.run_daily(
-        enviar_recordatorio,
-        time=time(hour=9, minute=0, tzinfo=pytz.utc),  # 9:00 UTC
-        days=(0, 1, 2, 3, 4, 5, 6)
+        refresh_reminder_minutes,
+        time=time(hour=0, minute=5, tzinfo=pytz.utc)
+    )
+
+    # Envíos masivos que se quedaron a medias (caída de un worker)
+    application.job_queue.run_repeating(
+        resume_broadcasts,
+        interval=Config.BROADCAST_LEASE,
+        first=30
+    )
+
+    # Volcado periódico de contadores
+    application.job_queue.run_repeating(
+        flush_counters,
+        interval=Config.COUNTER_FLUSH_INTERVAL,
+        first=Config.COUNTER_FLUSH_INTERVAL
+    )
+
+    # Recarga del contenido al cambiar los ficheros
+    if Config.CONTENT_WATCH_INTERVAL > 0:
+        application.job_queue.run_repeating(
+            watch_content,
+            interval=Config.CONTENT_WATCH_INTERVAL,
+            first=Config.CONTENT_WATCH_INTERVAL
+        )
+
+    # Registro de intentos y sus particiones mensuales
+    application.job_queue.run_repeating(
+        flush_attempts,
+        interval=Config.ATTEMPT_FLUSH_INTERVAL,
+        first=Config.ATTEMPT_FLUSH_INTERVAL
     )
+    application.job_queue.run_repeating(maintain_attempt_partitions, interval=86400, first=60)
+
+    # Retraso de la réplica de lectura
+    if replica_pool is not None:
+        application.job_queue.run_repeating(
+            monitor_replica_lag,
+            interval=Config.DB_REPLICA_LAG_CHECK_INTERVAL,
+            first=Config.DB_REPLICA_LAG_CHECK_INTERVAL
+        )
+
+    # Métricas del pool de conexiones
+    if Config.DB_POOL_STATS_INTERVAL > 0:
+        application.job_queue.run_repeating(
+            log_pool_stats,
+            interval=Config.DB_POOL_STATS_INTERVAL,
+            first=Config.DB_POOL_STATS_INTERVAL
+        )
 
     # Iniciar el bot
-    application.run_polling()
+    try:
+        if webhook:
+            logger.info(f"Webhook en {webhook['listen']}:{webhook['port']}/{webhook['url_path']}")
+            application.run_webhook(**webhook)
+        else:
+            application.run_polling()
+    finally:
+        blocked_users_listener.stop()
+        # No perder los incrementos acumulados al apagar
+        try:
+            counter_buffer.flush()
+        except Exception as e:
+            logger.error(f"Error al volcar contadores al apagar: {e}")
+        try:
+            attempt_log.flush()
+        except Exception as e:
+            logger.error(f"Error al volcar intentos al apagar: {e}")
+        close_db_pool()
+
+def run_migrations():
+    """Comando: python spanishDailybot.py migrate"""
+    init_db_pool()
+    try:
+        migrate()
+    finally:
+        close_db_pool()
+
+def build_pack():
+    """Comando: python spanishDailybot.py build-pack [destino]"""
+    path = sys.argv[2] if len(sys.argv) > 2 else (Config.CONTENT_PACK or "content.pack")
+    ejercicios = read_ejercicios()
+    init_db_pool()
+    try:
+        with db_cursor() as cursor:
+            ordinals = sync_exercise_ordinals_tx(cursor, ejercicios)
+    finally:
+        close_db_pool()
+    size = write_content_pack(path, ejercicios, ordinals)
+    logger.info(f"Content pack escrito en {path} ({size} bytes)")
+
+COMMANDS = {
+    "migrate": run_migrations,
+    "build-pack": build_pack,
+}
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        if sys.argv[1] not in COMMANDS:
+            raise SystemExit(f"Comando desconocido: {sys.argv[1]} (disponibles: {', '.join(COMMANDS)})")
+        COMMANDS[sys.argv[1]]()
+    else:
+        main()